@@ -0,0 +1 @@
+# This magic file makes this folder a python module.
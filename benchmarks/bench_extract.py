@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+from docopt import docopt
+import time
+
+from src.extract_discourse import discourse_client, extract_posts
+from tests.fake_discourse import FakeDiscourse, generate_corpus
+
+# DocOpt definition of the command line interface.
+help = """
+Measure extract throughput against a local fake Discourse, offline.
+
+Usage:
+    bench-extract [--posts=<posts>] [--page-size=<n>] [--latency=<seconds>] [--rate-limit-every=<n>]
+
+Options:
+    --posts=<posts>         How many posts to generate. [default: 5000]
+    --page-size=<n>         Posts per posts.json page. [default: 50]
+    --latency=<seconds>     Added to every request. [default: 0.05]
+    --rate-limit-every=<n>  Answer every nth request with a 429, 0 for never. [default: 0]
+"""
+
+
+def main(posts, page_size, latency, rate_limit_every):
+    categories, topics, raw_posts = generate_corpus(
+        topics=max(1, posts // 10), posts_per_topic=10)
+    rate_limited = range(rate_limit_every, posts, rate_limit_every) if rate_limit_every else ()
+    with FakeDiscourse(categories, topics, raw_posts, page_size, latency,
+                       rate_limited) as fake:
+        client = discourse_client(fake.url, "system", "key")
+        start = time.perf_counter()
+        extracted = extract_posts(client)
+        seconds = time.perf_counter() - start
+        requests = len(fake.request_log)
+    print(f"posts       {len(extracted)}")
+    print(f"requests    {requests}")
+    print(f"seconds     {seconds:.2f}")
+    print(f"posts/s     {len(extracted) / seconds:.0f}")
+
+
+# Main function
+if __name__ == "__main__":
+    arguments = docopt(help)
+    main(int(arguments["--posts"]), int(arguments["--page-size"]),
+         float(arguments["--latency"]), int(arguments["--rate-limit-every"]))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+from docopt import docopt
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# DocOpt definition of the command line interface.
+help = """
+Measure interpreter startup and import time for each discourse-algolia-etl
+command. Every sample runs in a fresh interpreter, the way main-etl and cron
+invoke the tool.
+
+Usage:
+    bench-startup [--runs=<runs>]
+
+Options:
+    --runs=<runs>  How many fresh interpreters to time per command. [default: 10]
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each command has imported by the time it starts working.
+COMMANDS = {
+    "python": "pass",
+    "cli": "import src.cli",
+    "extract": "import src.cli; src.cli.import_stage('extract')",
+    "transform": "import src.cli; src.cli.import_stage('transform')",
+    "load": "import src.cli; src.cli.import_stage('load')",
+}
+
+
+def import_time_us(code):
+    """ returns the cumulative import time of `code`'s top level imports in
+    microseconds, from python's -X importtime report."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    imports = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only count top level imports, nested ones are in their cumulative.
+        if not name.startswith("  "):
+            imports += int(cumulative)
+    return imports
+
+
+def wall_time_us(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+    return (time.perf_counter() - start) * 1e6
+
+
+def main(runs):
+    print(f"{'command':<10} {'wall ms':>9} {'imports ms':>11}")
+    for name, code in COMMANDS.items():
+        wall = statistics.median(wall_time_us(code) for _ in range(runs))
+        imports = statistics.median(import_time_us(code) for _ in range(runs))
+        print(f"{name:<10} {wall / 1000:>9.1f} {imports / 1000:>11.1f}")
+
+
+# Main function
+if __name__ == "__main__":
+    arguments = docopt(help)
+    main(int(arguments["--runs"]))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+from docopt import docopt
+import importlib
+import os
+import sys
+import time
+
+if __package__ in (None, ""):
+    # Run as src/cli.py, make the src package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.options import OPTIONS, options_help  # noqa: E402
+
+
+def print_to_stderr(*a, **k):
+    print(*a, file=sys.stderr, **k)
+
+
+# DocOpt definition of the command line interface.
+help = f"""
+Extract posts from Discourse, transform them into DocSearch records and load
+them into Algolia. Each command only imports the modules it needs, and `run`
+does all requested stages in a single process.
+
+A partial run is scoped with --since, --until, --topic and --category: extract
+fetches only those posts, transform only transforms them and writes a scope
+file, and `load --reconcile --scope-file` replaces only the records in scope.
+Run `load --setup-scope-facets` once per index before a topic or category run.
+
+Usage:
+    discourse-algolia-etl extract [--staging-db=<file>] [--full-payload] [--compact] [--since=<timestamp>] [--until=<timestamp>] [--topic=<topic-id>] [--category=<category-id>] [<discourse-json-file>]
+    discourse-algolia-etl transform --discourse-url=<discourse-url> --lvl0=<lvl0> --tag=<tag>... [--staging-db=<file>] [--since=<timestamp>] [--until=<timestamp>] [--topic=<topic-id>] [--category=<category-id>] [--scope-file=<file>] [--dedup=<mode> [--dedup-min-posts=<n>]] [--pack-bytes=<n>] [--max-html-bytes=<n>] [--max-parse-seconds=<s>] [--max-post-records=<n>] [--quarantine-report=<file>] [--priority=<spec>] [--compact] [<discourse-json-file> [<algolia-json-file>]]
+    discourse-algolia-etl load <algolia-json-file> <algolia-index-name> [--reconcile [--dry-run] [--scope-file=<file>] | --top-percent=<p> | --rebuild]
+    discourse-algolia-etl load --setup-scope-facets <algolia-index-name>
+    discourse-algolia-etl run (all|extract|transform|load)...
+    discourse-algolia-etl fanout <config-file> [--data-dir=<dir>]
+    discourse-algolia-etl (-h | --help)
+
+Options:
+{options_help(OPTIONS)}
+
+Files default to stdin and stdout when left out.
+
+Environment Variables:
+    DISCOURSE_URL        The URL of the Discourse instance.
+    DISCOURSE_USERNAME   The username to use for the Discourse API.
+    DISCOURSE_API_KEY    The API key to use for the Discourse API.
+    ALGOLIA_APP_ID
+    ALGOLIA_API_KEY
+    ALGOLIA_INDEX_NAME   The index `run` loads into.
+    DISCOURSE_DATA_FILE  Where `run` keeps the extracted data. (default: discourse.json, or discourse-partial.json when scoped)
+    ALGOLIA_DATA_FILE    Where `run` keeps the transformed data. (default: algolia.json, or algolia-partial.json when scoped)
+    ALGOLIA_LVL0         The lvl0 `run` transforms with. (default: Forum)
+    ALGOLIA_TAG          The tag `run` transforms with. (default: community)
+    ALGOLIA_PRIORITY     The --priority `run` transforms with, if any.
+    ALGOLIA_TOP_PERCENT  The --top-percent `run` loads with when ALGOLIA_PRIORITY is set. (default: 1)
+    ALGOLIA_REBUILD      Set to make `run` load with --rebuild.
+    DISCOURSE_SINCE, DISCOURSE_UNTIL, DISCOURSE_TOPIC, DISCOURSE_CATEGORY
+                         Scope `run` to these posts, and load with --reconcile.
+    ALGOLIA_SCOPE_FILE   Where a scoped `run` keeps the scope file. (default: algolia-scope.json)
+"""
+
+STAGES = ["extract", "transform", "load"]
+
+# Stage modules pull in heavy dependencies (fluent_discourse, bs4,
+# algoliasearch) so they are only imported once their stage runs.
+STAGE_MODULES = {
+    "extract": "src.extract_discourse",
+    "transform": "src.transform_discourse_to_algolia",
+    "load": "src.load_algolia",
+}
+
+# Command line options that scope extract and transform, and the main()
+# argument they map to.
+SCOPE_OPTIONS = {
+    "--since": "since",
+    "--until": "until",
+    "--topic": "topic_id",
+    "--category": "category_id",
+}
+
+# Command line options of `transform` and the main() argument they map to.
+TRANSFORM_OPTIONS = {
+    "--staging-db": "staging_db",
+    **SCOPE_OPTIONS,
+    "--scope-file": "scope_file",
+    "--dedup": "dedup",
+    "--dedup-min-posts": "dedup_min_posts",
+    "--pack-bytes": "pack_bytes",
+    "--max-html-bytes": "max_html_bytes",
+    "--max-parse-seconds": "max_parse_seconds",
+    "--max-post-records": "max_post_records",
+    "--quarantine-report": "quarantine_report",
+    "--priority": "priority",
+    "--compact": "compact",
+}
+
+
+def import_stage(stage):
+    return importlib.import_module(STAGE_MODULES[stage])
+
+
+def open_or_std(path, mode, std):
+    if path is None or path == "-":
+        return std
+    return open(path, mode)
+
+
+def extract(output_file=None, staging_db=None, full_payload=False, compact=False,
+            **scope):
+    """ scope is passed on to extract_discourse.main()."""
+    extract_discourse = import_stage("extract")
+    output_textio = open_or_std(output_file, "w", sys.stdout)
+    try:
+        extract_discourse.main(output_textio, staging_db, full_payload, compact,
+                               **scope)
+    finally:
+        if output_textio is not sys.stdout:
+            output_textio.close()
+
+
+def transform(discourse_url, lvl0, tags, input_file=None, output_file=None,
+              **options):
+    """ options are passed on to transform_discourse_to_algolia.main()."""
+    transform_discourse_to_algolia = import_stage("transform")
+    input_textio = open_or_std(input_file, "r", sys.stdin)
+    output_textio = open_or_std(output_file, "w", sys.stdout)
+    try:
+        transform_discourse_to_algolia.main(
+            input_textio, output_textio, discourse_url, lvl0, tags, **options)
+    finally:
+        if input_textio is not sys.stdin:
+            input_textio.close()
+        if output_textio is not sys.stdout:
+            output_textio.close()
+
+
+def load(json_file, algolia_index_name, reconcile=False, dry_run=False,
+         top_percent=None, rebuild=False, scope_file=None, scope_facets=False):
+    load_algolia = import_stage("load")
+    load_algolia.main(json_file, algolia_index_name, reconcile, dry_run,
+                      top_percent, rebuild, scope_file, scope_facets)
+
+
+def run(stages):
+    """ run the requested stages in pipeline order, configured from the same
+    environment variables as main-etl."""
+    scope = {name: os.environ.get(variable) for name, variable in [
+        ("since", "DISCOURSE_SINCE"), ("until", "DISCOURSE_UNTIL"),
+        ("topic_id", "DISCOURSE_TOPIC"), ("category_id", "DISCOURSE_CATEGORY")]}
+    scope_file = None
+    if any(scope.values()):
+        scope_file = os.environ.get("ALGOLIA_SCOPE_FILE", "algolia-scope.json")
+    # A scoped run holds part of the forum, keep it apart from a full run's data.
+    suffix = "-partial" if scope_file else ""
+    discourse_data_file = os.environ.get("DISCOURSE_DATA_FILE", f"discourse{suffix}.json")
+    algolia_data_file = os.environ.get("ALGOLIA_DATA_FILE", f"algolia{suffix}.json")
+    priority = os.environ.get("ALGOLIA_PRIORITY") or None
+    top_percent = os.environ.get("ALGOLIA_TOP_PERCENT", "1") if priority else None
+    rebuild = bool(os.environ.get("ALGOLIA_REBUILD"))
+    for stage in STAGES:
+        if stage not in stages and "all" not in stages:
+            continue
+        start = time.perf_counter()
+        if stage == "extract":
+            print_to_stderr("Extracting data from Discourse...")
+            # The intermediate files are only read back by the next stage.
+            extract(discourse_data_file, compact=True, **scope)
+        elif stage == "transform":
+            print_to_stderr("Transforming data...")
+            transform(os.environ["DISCOURSE_URL"],
+                      os.environ.get("ALGOLIA_LVL0", "Forum"),
+                      [os.environ.get("ALGOLIA_TAG", "community")],
+                      discourse_data_file, algolia_data_file, priority=priority,
+                      scope_file=scope_file, compact=True, **scope)
+        elif stage == "load":
+            print_to_stderr("Loading data into Algolia...")
+            # A scoped run must only replace the records in its scope.
+            load(algolia_data_file, os.environ["ALGOLIA_INDEX_NAME"],
+                 reconcile=scope_file is not None, top_percent=top_percent,
+                 rebuild=rebuild and scope_file is None, scope_file=scope_file)
+        print_to_stderr(f"{stage} took {time.perf_counter() - start:.1f}s")
+
+
+def fanout(config_file, data_dir):
+    """ run the jobs of a multi-forum config file, see `python3 -m src.fanout --help`."""
+    fanout = importlib.import_module("src.fanout")
+    if not fanout.main(config_file, data_dir):
+        sys.exit(1)
+
+
+def main(argv=None):
+    arguments = docopt(help, argv)
+    # Stage names repeat under `run`, so check it first.
+    if arguments["run"]:
+        run([stage for stage in ["all"] + STAGES if arguments[stage]])
+    elif arguments["extract"]:
+        scope = {name: arguments[option] for option, name in SCOPE_OPTIONS.items()}
+        extract(arguments["<discourse-json-file>"], arguments["--staging-db"],
+                arguments["--full-payload"], arguments["--compact"], **scope)
+    elif arguments["transform"]:
+        options = {name: arguments[option]
+                   for option, name in TRANSFORM_OPTIONS.items()}
+        transform(arguments["--discourse-url"], arguments["--lvl0"],
+                  arguments["--tag"], arguments["<discourse-json-file>"],
+                  arguments["<algolia-json-file>"], **options)
+    elif arguments["load"]:
+        load(arguments["<algolia-json-file>"], arguments["<algolia-index-name>"],
+             arguments["--reconcile"], arguments["--dry-run"],
+             arguments["--top-percent"], arguments["--rebuild"],
+             arguments["--scope-file"], arguments["--setup-scope-facets"])
+    elif arguments["fanout"]:
+        fanout(arguments["<config-file>"], arguments["--data-dir"])
+
+
+# Main function
+if __name__ == "__main__":
+    main()
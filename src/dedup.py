@@ -0,0 +1,83 @@
+from hashlib import sha1
+import re
+
+# What to do with a section repeated in at least `min_posts` posts.
+DEDUP_MODES = [
+    "drop",   # drop every copy.
+    "first",  # keep it only in the earliest post.
+]
+
+WHITESPACE = re.compile(r"\s+")
+
+# Parts of pasted logs and canned replies that change between copies:
+# numbers, timestamps, hex ids and hashes.
+VOLATILE = re.compile(r"0x[0-9a-f]+|[0-9a-f]{8,}|\d+")
+
+
+def normalize(text):
+    return WHITESPACE.sub(" ", text.lower()).strip()
+
+
+def fingerprint(text):
+    """ sections that only differ in case, whitespace, numbers or ids share a
+    fingerprint."""
+    return sha1(VOLATILE.sub("0", normalize(text)).encode('utf-8')).hexdigest()
+
+
+class SectionDeduplicator:
+    """ suppresses section text repeated across many posts. Every post's
+    sections are added before any are checked with keep()."""
+
+    def __init__(self, min_posts, mode="first"):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode '{mode}', use one of {DEDUP_MODES}")
+        self.min_posts = min_posts
+        self.mode = mode
+        # fingerprint => [number of posts, earliest post id]
+        self._fingerprints = {}
+        # fingerprint => normalized text of its first copy, to tell exact
+        # copies from near-duplicates.
+        self._first_text = {}
+        self.stats = {
+            "sections": 0,
+            "repeated": 0,
+            "suppressed": 0,
+            "suppressed_exact": 0,
+            "suppressed_bytes": 0,
+        }
+
+    def add(self, post_id, texts):
+        for key in {fingerprint(text) for text in texts}:
+            seen = self._fingerprints.get(key)
+            if seen is None:
+                self._fingerprints[key] = [1, post_id]
+            else:
+                seen[0] += 1
+                seen[1] = min(seen[1], post_id)
+
+    def keep(self, post_id, text):
+        """ returns False if this copy of the text should not be indexed."""
+        self.stats["sections"] += 1
+        key = fingerprint(text)
+        post_count, earliest_post_id = self._fingerprints.get(key, (0, None))
+        if post_count < self.min_posts:
+            return True
+        normalized = normalize(text)
+        first_text = self._first_text.setdefault(key, normalized)
+        if self.mode == "first" and post_id == earliest_post_id:
+            return True
+        self.stats["suppressed"] += 1
+        self.stats["suppressed_bytes"] += len(text.encode('utf-8'))
+        if normalized == first_text:
+            self.stats["suppressed_exact"] += 1
+        return False
+
+    def summary(self):
+        self.stats["repeated"] = sum(
+            1 for post_count, _ in self._fingerprints.values()
+            if post_count >= self.min_posts)
+        return (f"Dedup: {self.stats['repeated']} sections repeated in "
+                f"{self.min_posts}+ posts, suppressed {self.stats['suppressed']} "
+                f"of {self.stats['sections']} sections "
+                f"({self.stats['suppressed_exact']} exact copies, "
+                f"{self.stats['suppressed_bytes']} bytes).")
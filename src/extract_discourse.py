@@ -2,14 +2,31 @@
 
 from docopt import docopt
 from fluent_discourse import Discourse
-import json
+import os
 import sys
+import threading
+import time
+
+if __package__ in (None, ""):
+    # Run as src/extract_discourse.py, make the src package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import json_codec  # noqa: E402
+from src.options import EXTRACT_OPTIONS, options_help  # noqa: E402
+from src.scope import Scope, parse_time  # noqa: E402
+from src.staging import StagingStore  # noqa: E402
 
 # DocOpt definition of the command line interface.
-help = """ Extract posts and categories from Discourse to stdout.
+help = f""" Extract posts and categories from Discourse to stdout, or upsert them
+into a SQLite staging database.
+
+With --since, paging stops at posts created before it, so edits to older
+posts are not picked up.
 
 Usage:
-    discourse-extract
+    discourse-extract [--staging-db=<file>] [--full-payload] [--compact] [--since=<timestamp>] [--until=<timestamp>] [--topic=<topic-id>] [--category=<category-id>]
+
+Options:
+{options_help(EXTRACT_OPTIONS)}
 
 Environment Variables:
     DISCOURSE_URL       The URL of the Discourse instance.
@@ -22,38 +39,270 @@ def print_to_stderr(*a, **k):
     print(*a, file=sys.stderr, **k)
 
 
-def extract_posts():
-    # Make sure to set DISCOURSE_URL, DISCOURSE_USERNAME, and DISCOURSE_API_KEY
-    client = Discourse.from_env(raise_for_rate_limit=False)
+# Discourse returns at most this many posts per topic posts request.
+TOPIC_POSTS_PAGE_SIZE = 20
+
+# The post fields used by the transform, --priority and incremental runs. Discourse
+# returns dozens more (avatar_template, can_edit, flair_*, actions_summary...)
+POST_FIELDS = [
+    "id",
+    "cooked",
+    "post_number",
+    "topic_id",
+    "topic_slug",
+    "topic_title",
+    "topic_accepted_answer",
+    "category_id",
+    "hidden",
+    "deleted_at",
+    "version",
+    "created_at",
+    "updated_at",
+    "reads",
+    "score",
+]
+
+CATEGORY_FIELDS = [
+    "id",
+    "name",
+    "slug",
+    "read_restricted",
+]
+
+# Projection sizes are measured on this many pages, encoding every page twice
+# just to report the saving would cost more than the saving is worth.
+PROJECTION_SAMPLE_PAGES = 5
+
+
+class PostProjection:
+    """ keeps only POST_FIELDS of each post, unless full_payload is set, and
+    counts the json bytes before and after on the first `sample_pages`."""
+
+    def __init__(self, full_payload=False, sample_pages=PROJECTION_SAMPLE_PAGES):
+        self.full_payload = full_payload
+        self.sample_pages = sample_pages
+        self.pages = 0
+        self.raw_bytes = 0
+        self.kept_bytes = 0
+
+    def __call__(self, posts):
+        if self.full_payload:
+            return posts
+        projected = [project(post, POST_FIELDS) for post in posts]
+        if self.pages < self.sample_pages:
+            self.raw_bytes += len(json_codec.dumps(posts))
+            self.kept_bytes += len(json_codec.dumps(projected))
+        self.pages += 1
+        return projected
+
+    def summary(self):
+        if self.full_payload:
+            return "Kept full post payloads."
+        ratio = self.raw_bytes / self.kept_bytes if self.kept_bytes else 1
+        sampled = min(self.pages, self.sample_pages)
+        return (f"Kept {self.kept_bytes} of {self.raw_bytes} bytes of post json "
+                f"on the first {sampled} of {self.pages} pages ({ratio:.1f}x smaller).")
+
+
+def project(item, fields):
+    return {field: item[field] for field in fields if field in item}
+
+
+class RateLimiter:
+    """ spaces out requests so at most `requests_per_second` are started.
+    Shared by every client that talks to the same forum."""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second
+        self._lock = threading.Lock()
+        self._next_request = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_request - now
+            self._next_request = max(now, self._next_request) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimitedDiscourse(Discourse):
+    """ a fluent_discourse client that waits on a RateLimiter before every
+    request."""
+
+    def __init__(self, base_url, username, api_key, rate_limiter, cache=None,
+                 raise_for_rate_limit=True):
+        super().__init__(base_url, username, api_key, cache, raise_for_rate_limit)
+        self._rate_limiter = rate_limiter
+
+    def _(self, name):
+        return RateLimitedDiscourse(
+            self._base_url,
+            self._username,
+            self._api_key,
+            self._rate_limiter,
+            self._cache + [str(name)],
+            self._raise_for_rate_limit,
+        )
+
+    def _request(self, method, url, data=None, params=None):
+        self._rate_limiter.wait()
+        return super()._request(method, url, data, params)
+
+
+def discourse_client(base_url, username, api_key, rate_limiter=None):
+    if rate_limiter is None:
+        return Discourse(base_url, username, api_key, raise_for_rate_limit=False)
+    return RateLimitedDiscourse(base_url, username, api_key, rate_limiter,
+                                raise_for_rate_limit=False)
+
 
+def extract_posts(client=None, projection=None):
     all_posts = []
+    for posts in extract_post_pages(client, projection):
+        all_posts.extend(posts)
+    return all_posts
+
+
+def extract_post_pages(client=None, projection=None, since=None):
+    """ yield pages of posts from newest to oldest, projected down to
+    POST_FIELDS unless a full payload PostProjection is given. With `since`,
+    stop after the first page that reaches posts created before it."""
+    if projection is None:
+        projection = PostProjection()
+    # Make sure to set DISCOURSE_URL, DISCOURSE_USERNAME, and DISCOURSE_API_KEY
+    if client is None:
+        client = Discourse.from_env(raise_for_rate_limit=False)
+
     none_yet = 0
     earliest_extracted_post_id = none_yet
     while earliest_extracted_post_id != 1:
         print_to_stderr(f"Fetching posts before {earliest_extracted_post_id}")
         posts = client.posts.json.get({"before": earliest_extracted_post_id})
-        all_posts.extend(posts["latest_posts"])
+        if not posts["latest_posts"]:
+            # Post 1 was deleted, there is nothing older.
+            return
+        yield projection(posts["latest_posts"])
         last_post = posts["latest_posts"][-1]
+        if since is not None and (not last_post.get("created_at")
+                                  or parse_time(last_post["created_at"]) < parse_time(since)):
+            return
         earliest_extracted_post_id = last_post["id"]
-    return all_posts
 
 
-def extract_categories():
+def extract_categories(client=None, full_payload=False):
     # Make sure to set DISCOURSE_URL, DISCOURSE_USERNAME, and DISCOURSE_API_KEY
-    client = Discourse.from_env(raise_for_rate_limit=False)
+    if client is None:
+        client = Discourse.from_env(raise_for_rate_limit=False)
     site = client.site.json.get()
     raw_categories = site["categories"]
-    return raw_categories
+    if full_payload:
+        return raw_categories
+    return [project(category, CATEGORY_FIELDS) for category in raw_categories]
 
 
-# Main function
-if __name__ == "__main__":
-    # Parse arguments
-    arguments = docopt(help)
+def extract_topic_posts(topic_id, client=None):
+    """ fetch every post of one topic, shaped like the entries of posts.json
+    so they can be fed straight into the transform."""
+    if client is None:
+        client = Discourse.from_env(raise_for_rate_limit=False)
+    topic = client.t[topic_id].json.get()
+    posts = list(topic["post_stream"]["posts"])
+    loaded = {post["id"] for post in posts}
+    missing = [post_id for post_id in topic["post_stream"]["stream"]
+               if post_id not in loaded]
+    # Discourse only embeds the first page of posts, fetch the rest by id.
+    for start in range(0, len(missing), TOPIC_POSTS_PAGE_SIZE):
+        page = client.t[topic_id].posts.json.get(
+            {"post_ids[]": missing[start:start + TOPIC_POSTS_PAGE_SIZE]})
+        posts.extend(page["post_stream"]["posts"])
+    return [with_topic_fields(post, topic) for post in posts]
+
+
+def extract_category_topic_ids(category_id, client=None):
+    """ list the ids of the topics in a category, a page at a time."""
+    if client is None:
+        client = Discourse.from_env(raise_for_rate_limit=False)
+    topic_ids = []
+    page = 0
+    while True:
+        topics = client.c[category_id].json.get({"page": page})["topic_list"]["topics"]
+        if not topics:
+            return topic_ids
+        topic_ids.extend(topic["id"] for topic in topics)
+        page += 1
+
+
+def extract_scope_pages(scope, client=None, projection=None):
+    """ yield pages of the posts in a Scope, fetching only the topic or the
+    category's topics when it has one, and paging posts.json otherwise."""
+    if projection is None:
+        projection = PostProjection()
+    if scope.topic_id is not None:
+        pages = (projection(extract_topic_posts(scope.topic_id, client)),)
+    elif scope.category_id is not None:
+        pages = (projection(extract_topic_posts(topic_id, client))
+                 for topic_id in extract_category_topic_ids(scope.category_id, client))
+    else:
+        pages = extract_post_pages(client, projection, scope.since)
+    for posts in pages:
+        yield [post for post in posts if scope.contains(post)]
+
+
+def with_topic_fields(post, topic):
+    """ topic endpoints leave out the topic fields that posts.json includes on
+    every post, copy them over from the topic."""
+    post = dict(post)
+    post.setdefault("topic_id", topic["id"])
+    post.setdefault("topic_slug", topic["slug"])
+    post.setdefault("topic_title", topic["title"])
+    post.setdefault("category_id", topic["category_id"])
+    post.setdefault("topic_accepted_answer", bool(topic.get("accepted_answer")))
+    post.setdefault("hidden", False)
+    post.setdefault("deleted_at", None)
+    return post
+
+
+def extract_to_staging(staging_db, client=None, projection=None, scope=None):
+    """ upsert posts into the staging store as each page arrives, so the
+    archive never has to be held in memory."""
+    full_payload = projection is not None and projection.full_payload
+    scope = scope or Scope()
+    with StagingStore(staging_db) as store:
+        for posts in extract_scope_pages(scope, client, projection):
+            store.upsert_posts(posts)
+        store.upsert_categories(extract_categories(client, full_payload))
+        return store.count_posts()
+
+
+def main(output_textio, staging_db=None, full_payload=False, compact=False,
+         since=None, until=None, topic_id=None, category_id=None):
+    projection = PostProjection(full_payload)
+    scope = Scope(since, until, topic_id, category_id)
+    if scope:
+        print_to_stderr(f"Extracting {scope}")
+    if staging_db:
+        count = extract_to_staging(staging_db, projection=projection, scope=scope)
+        print_to_stderr(f"Staged {count} posts in {staging_db}")
+        print_to_stderr(projection.summary())
+        return
     # Extract posts
+    posts = []
+    for page in extract_scope_pages(scope, projection=projection):
+        posts.extend(page)
     data = {
-        "posts": extract_posts(),
-        "categories": extract_categories()
+        "posts": posts,
+        "categories": extract_categories(full_payload=full_payload)
     }
+    print_to_stderr(projection.summary())
     # pretty print data
-    print(json.dumps(data, indent=2))
+    print(json_codec.dumps(data, indent=None if compact else 2), file=output_textio)
+
+
+# Main function
+if __name__ == "__main__":
+    # Parse arguments
+    arguments = docopt(help)
+    main(sys.stdout, arguments["--staging-db"], arguments["--full-payload"],
+         arguments["--compact"], arguments["--since"], arguments["--until"],
+         arguments["--topic"], arguments["--category"])
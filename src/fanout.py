@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from docopt import docopt
+import multiprocessing
+import os
+import sys
+import time
+
+if __package__ in (None, ""):
+    # Run as src/fanout.py, make the src package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import json_codec  # noqa: E402
+from src.extract_discourse import (RateLimiter, discourse_client,  # noqa: E402
+                                   extract_categories, extract_posts)
+from src.load_algolia import load  # noqa: E402
+from src.options import FANOUT_OPTIONS, options_help  # noqa: E402
+from src.quarantine import PostBudget  # noqa: E402
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia  # noqa: E402
+
+
+# Transform workers are started while the extract and job threads are making
+# requests, and forking a process with threads can deadlock on a held lock.
+SPAWN = multiprocessing.get_context("spawn")
+
+
+def print_to_stderr(*a, **k):
+    print(*a, file=sys.stderr, **k)
+
+
+# DocOpt definition of the command line interface.
+help = f"""
+Run the ETL for several Discourse forums and Algolia indexes at once. Jobs are
+read from a JSON config file and scheduled over shared, bounded pools of
+extract, transform and load workers, so the total time tracks the largest
+forum rather than the sum of all of them.
+
+Usage:
+    fanout-etl <config-file> [--data-dir=<dir>]
+
+Options:
+{options_help(FANOUT_OPTIONS)}
+
+Config file:
+    {{
+        "workers": {{"extract": 4, "transform": 2, "load": 4}},
+        "jobs": [{{
+            "name": "blues",
+            "discourse_url": "https://discuss.blues.io",
+            "discourse_username": "system",
+            "discourse_api_key_env": "BLUES_DISCOURSE_API_KEY",
+            "algolia_index_name": "blues-forum",
+            "lvl0": "Forum",
+            "tags": ["community"],
+            "requests_per_second": 2
+        }}]
+    }}
+
+    Only name, discourse_url and algolia_index_name are required. The username
+    and api key default to DISCOURSE_USERNAME and DISCOURSE_API_KEY. Jobs for
+    the same forum share its rate limit.
+
+Environment Variables:
+    ALGOLIA_APP_ID
+    ALGOLIA_API_KEY
+"""
+
+REQUIRED_JOB_KEYS = [
+    "name",
+    "discourse_url",
+    "algolia_index_name",
+]
+
+JOB_DEFAULTS = {
+    "discourse_username": None,
+    "discourse_api_key_env": "DISCOURSE_API_KEY",
+    "lvl0": "Forum",
+    "tags": ["community"],
+    "requests_per_second": None,
+}
+
+DEFAULT_WORKERS = {
+    "extract": 4,
+    "transform": os.cpu_count() or 1,
+    "load": 4,
+}
+
+
+def read_config(config_file):
+    """ returns (jobs, workers) from a fan-out config file."""
+    with open(config_file) as f:
+        config = json_codec.load(f)
+    workers = dict(DEFAULT_WORKERS, **config.get("workers", {}))
+    jobs = []
+    for raw_job in config["jobs"]:
+        missing = [key for key in REQUIRED_JOB_KEYS if key not in raw_job]
+        if missing:
+            raise ValueError(f"Job is missing {', '.join(missing)}: {raw_job}")
+        jobs.append(dict(JOB_DEFAULTS, **raw_job))
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Job names must be unique: {names}")
+    return jobs, workers
+
+
+def extract_job(job, discourse_file, rate_limiter):
+    client = discourse_client(
+        job["discourse_url"],
+        job["discourse_username"] or os.environ.get("DISCOURSE_USERNAME"),
+        os.environ.get(job["discourse_api_key_env"]),
+        rate_limiter)
+    data = {
+        "posts": extract_posts(client),
+        "categories": extract_categories(client)
+    }
+    with open(discourse_file, "w") as f:
+        json_codec.dump(data, f, indent=2)
+    return len(data["posts"])
+
+
+def transform_job(job, discourse_file, algolia_file):
+    with open(discourse_file) as f:
+        data = json_codec.load(f)
+    budget = PostBudget.with_default_limits()
+    transformer = TransformDiscourseToAlgolia(
+        job["discourse_url"], data["categories"], data["posts"], job["lvl0"], job["tags"],
+        budget=budget)
+    with open(algolia_file, "w") as f:
+        json_codec.dump(transformer.algolia_objects, f, indent=4, sort_keys=True)
+    if budget.quarantined:
+        print_to_stderr(f"[{job['name']}] {budget.summary()}")
+    return len(transformer.algolia_objects)
+
+
+def load_job(job, algolia_file):
+    return load(job["algolia_index_name"], os.environ.get('ALGOLIA_APP_ID'),
+                os.environ.get('ALGOLIA_API_KEY'), algolia_file)
+
+
+class FanOut:
+    """ runs every job through extract, transform and load. Each stage has its
+    own bounded pool shared by all jobs; transforms run in processes since
+    they are CPU bound. `status` holds the progress of each job by name."""
+
+    def __init__(self, jobs, workers, data_dir=".",
+                 extract=extract_job, transform=transform_job, load=load_job):
+        self.jobs = jobs
+        self.workers = workers
+        self.data_dir = data_dir
+        self.extract = extract
+        self.transform = transform
+        self.load = load
+        self.status = {job["name"]: {"state": "queued"} for job in jobs}
+        self._rate_limiters = {}
+        for job in jobs:
+            if job["requests_per_second"] and job["discourse_url"] not in self._rate_limiters:
+                self._rate_limiters[job["discourse_url"]] = RateLimiter(
+                    job["requests_per_second"])
+
+    def run(self):
+        with ThreadPoolExecutor(self.workers["extract"]) as extract_pool, \
+                ProcessPoolExecutor(self.workers["transform"],
+                                    mp_context=SPAWN) as transform_pool, \
+                ThreadPoolExecutor(self.workers["load"]) as load_pool, \
+                ThreadPoolExecutor(len(self.jobs) or 1) as job_pool:
+            self._pools = {
+                "extract": extract_pool,
+                "transform": transform_pool,
+                "load": load_pool,
+            }
+            # Job threads only wait on the stage pools, they do no work.
+            list(job_pool.map(self._run_job, self.jobs))
+        return self.status
+
+    def _run_job(self, job):
+        status = self.status[job["name"]]
+        start = time.perf_counter()
+        discourse_file = os.path.join(self.data_dir, f"{job['name']}.discourse.json")
+        algolia_file = os.path.join(self.data_dir, f"{job['name']}.algolia.json")
+        try:
+            status["posts"] = self._stage(
+                job, "extract", self.extract, job, discourse_file,
+                self._rate_limiters.get(job["discourse_url"]))
+            status["objects"] = self._stage(
+                job, "transform", self.transform, job, discourse_file, algolia_file)
+            status["loaded"] = self._stage(
+                job, "load", self.load, job, algolia_file)
+            status["state"] = "done"
+        except Exception as e:
+            status["state"] = "failed"
+            status["error"] = f"{type(e).__name__}: {e}"
+            print_to_stderr(f"[{job['name']}] failed: {status['error']}")
+        status["seconds"] = round(time.perf_counter() - start, 1)
+
+    def _stage(self, job, stage, function, *args):
+        self.status[job["name"]]["state"] = stage
+        result = self._pools[stage].submit(function, *args).result()
+        print_to_stderr(f"[{job['name']}] {stage} done: {result}")
+        return result
+
+
+def print_status(status):
+    print(f"{'job':<20} {'state':<10} {'posts':>7} {'objects':>8} {'seconds':>8}")
+    for name, job_status in status.items():
+        print(f"{name:<20} {job_status['state']:<10} {job_status.get('posts', '-'):>7} "
+              f"{job_status.get('objects', '-'):>8} {job_status.get('seconds', '-'):>8}")
+        if "error" in job_status:
+            print(f"    {job_status['error']}")
+
+
+def main(config_file, data_dir="."):
+    jobs, workers = read_config(config_file)
+    status = FanOut(jobs, workers, data_dir).run()
+    print_status(status)
+    return all(job_status["state"] == "done" for job_status in status.values())
+
+
+# Main function
+if __name__ == "__main__":
+    # Parse arguments
+    arguments = docopt(help)
+    ok = main(arguments["<config-file>"], arguments["--data-dir"])
+    sys.exit(0 if ok else 1)
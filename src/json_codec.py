@@ -0,0 +1,43 @@
+import json
+
+# orjson is optional, it is several times faster than the stdlib for the large
+# discourse and algolia files.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """ parse json from a str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load(textio):
+    return loads(textio.read())
+
+
+def dumps(obj, indent=None, sort_keys=False):
+    """ compact json when indent is None, otherwise pretty printed. orjson
+    only pretty prints with an indent of 2, so other indents use the stdlib."""
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option).decode('utf-8')
+    separators = (",", ":") if indent is None else None
+    return json.dumps(obj, indent=indent, sort_keys=sort_keys, separators=separators)
+
+
+def dump(obj, textio, indent=None, sort_keys=False):
+    textio.write(dumps(obj, indent, sort_keys))
+
+
+def canonical(obj, sort_keys=False):
+    """ the stdlib's default encoding. objectIDs, content hashes and record
+    size checks are computed from it, so they don't change with the codec."""
+    return json.dumps(obj, sort_keys=sort_keys)
@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
 from algoliasearch.search_client import SearchClient
+from concurrent.futures import ThreadPoolExecutor
 from docopt import docopt
-import json
+import math
 import os
+import re
 import sys
+import time
+
+if __package__ in (None, ""):
+    # Run as src/load_algolia.py, make the src package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import json_codec  # noqa: E402
+from src.options import LOAD_OPTIONS, options_help  # noqa: E402
+from src.record_hash import CONTENT_HASH_ATTRIBUTE, with_content_hash  # noqa: E402
+from src.scope import read_scope_file  # noqa: E402
 
 
 def print_to_stderr(*a, **k):
@@ -14,11 +25,32 @@ debug = False
 debug_log = print_to_stderr if debug else lambda *a, **k: None
 
 # DocOpt definition of the command line interface.
-help = """
+help = f"""
 Load objects into Algolia from a file via the Algolia API.
 
+With --reconcile, only the objectID, content hash and url of every record in
+the index are read, and only the records that are missing, changed or no longer
+in the file are upserted or deleted. Records of other forums or sources sharing
+the index are never deleted. With --scope-file, written by the transform
+of a partial run, only the index records in that scope are compared, so records
+outside it are left alone. A topic or category scope is browsed with a filter on
+the records' topic_id and category_id, which --setup-scope-facets makes
+filterable once per index. Until then such a reconcile fails without changes.
+
+With --top-percent, records are uploaded in file order, which is priority order
+when the transform ran with --priority, and the first records are made
+searchable before the rest are sent.
+
+With --rebuild, records are uploaded in parallel into a temporary index with
+the settings, synonyms and rules of the live one, which is then moved over the
+live index in one step. Queries never see a half loaded index.
+
 Usage:
-    load-algolia <algolia-json-file> <algolia-index-name>
+    load-algolia <algolia-json-file> <algolia-index-name> [--reconcile [--dry-run] [--scope-file=<file>] | --top-percent=<p> | --rebuild]
+    load-algolia --setup-scope-facets <algolia-index-name>
+
+Options:
+{options_help(LOAD_OPTIONS)}
 
 Environment Variables:
     ALGOLIA_APP_ID
@@ -26,38 +58,261 @@ Environment Variables:
 """
 
 
-def load(algolia_index_name, algolia_app_id, algolia_api_key, json_file):
+# --rebuild uploads batches of this many records on this many threads.
+REBUILD_BATCH_SIZE = 1000
+REBUILD_WORKERS = 8
+
+# A temporary index younger than this may belong to a rebuild that is still
+# running, so it isn't cleaned up as left over.
+REBUILD_STALE_SECONDS = 24 * 60 * 60
+
+# What --rebuild copies from the live index to the temporary one.
+REBUILD_COPY_SCOPE = ["settings", "synonyms", "rules"]
+
+# Record attributes a scoped reconcile filters the index on.
+SCOPE_FACETS = ["topic_id", "category_id"]
+
+
+def plan_reconcile(objects, remote_hits):
+    """ compare local objects against an iterable of remote hits holding only
+    objectID and content hash. Returns (objects to upsert, objectIDs to
+    delete). The remote hits are consumed one at a time."""
+    remaining = {algolia_object["objectID"]: algolia_object for algolia_object in objects}
+    upserts = []
+    deletes = []
+    for hit in remote_hits:
+        algolia_object = remaining.pop(hit["objectID"], None)
+        if algolia_object is None:
+            deletes.append(hit["objectID"])
+        elif hit.get(CONTENT_HASH_ATTRIBUTE) != algolia_object[CONTENT_HASH_ATTRIBUTE]:
+            upserts.append(algolia_object)
+    # Whatever wasn't in the index yet.
+    upserts.extend(remaining.values())
+    return upserts, deletes
+
+
+def forum_url(url):
+    """ the forum a record's post url, <forum>/t/<slug>/<topic>/<post>, is on."""
+    return url.partition("/t/")[0] if url else None
+
+
+def hits_of_forums(remote_hits, objects):
+    """ only the hits of the forums the objects come from, so reconcile never
+    deletes the records other sources keep in a shared index."""
+    forums = {forum_url(algolia_object["url"]) for algolia_object in objects}
+    return (hit for hit in remote_hits if forum_url(hit.get("url")) in forums)
+
+
+def hits_in_scope(remote_hits, scope, post_urls):
+    return (hit for hit in remote_hits
+            if scope.contains_record(hit.get("url"), post_urls))
+
+
+def facet_attribute(facet):
+    # attributesForFaceting entries may be wrapped, e.g. filterOnly(topic_id).
+    return facet.rpartition("(")[2].rstrip(")")
+
+
+def missing_scope_facets(facets):
+    """ the SCOPE_FACETS that aren't in the attributesForFaceting `facets`."""
+    present = {facet_attribute(facet) for facet in facets}
+    return [attribute for attribute in SCOPE_FACETS if attribute not in present]
+
+
+def ensure_scope_facets(index):
+    """ make SCOPE_FACETS filterable, keeping the index's other facets.
+    Returns the attributes that were added."""
+    facets = index.get_settings().get("attributesForFaceting") or []
+    missing = missing_scope_facets(facets)
+    if missing:
+        index.set_settings({"attributesForFaceting": facets + [
+            f"filterOnly({attribute})" for attribute in missing]}).wait()
+    return missing
+
+
+def require_scope_facets(index, algolia_index_name):
+    """ raise if a scoped reconcile can't filter the index on SCOPE_FACETS.
+    Changing the live index's settings is left to --setup-scope-facets."""
+    facets = index.get_settings().get("attributesForFaceting") or []
+    missing = missing_scope_facets(facets)
+    if missing:
+        raise RuntimeError(
+            f"Index '{algolia_index_name}' can't filter on {', '.join(missing)}, "
+            f"make them filterable once with `load-algolia --setup-scope-facets "
+            f"{algolia_index_name}` before a topic or category reconcile")
+
+
+def setup_scope_facets(algolia_index_name, algolia_app_id, algolia_api_key):
+    """ make the index filterable for scoped reconciles. Returns the
+    attributes that were added."""
+    client = SearchClient.create(algolia_app_id, algolia_api_key)
+    return ensure_scope_facets(client.init_index(algolia_index_name))
+
+
+def reconcile(algolia_index_name, algolia_app_id, algolia_api_key, json_file,
+              dry_run=False, scope_file=None):
+    client = SearchClient.create(algolia_app_id, algolia_api_key)
+    index = client.init_index(algolia_index_name)
+
+    with open(json_file) as f:
+        objects = with_content_hash(json_codec.load(f))
+
+    print_to_stderr(f"Comparing {len(objects)} objects with the index...")
+    browse = {"attributesToRetrieve": ["objectID", CONTENT_HASH_ATTRIBUTE, "url"]}
+    if scope_file:
+        scope, post_urls = read_scope_file(scope_file)
+        print_to_stderr(f"Only reconciling {scope}")
+        filters = scope.record_filters()
+        if filters:
+            require_scope_facets(index, algolia_index_name)
+            browse["filters"] = filters
+    remote_hits = hits_of_forums(index.browse_objects(browse), objects)
+    if scope_file:
+        remote_hits = hits_in_scope(remote_hits, scope, post_urls)
+    upserts, deletes = plan_reconcile(objects, remote_hits)
+    print_to_stderr(f"{len(upserts)} objects to upsert, {len(deletes)} to delete")
+    if not dry_run:
+        if upserts:
+            index.save_objects(upserts).wait()
+        if deletes:
+            index.delete_objects(deletes).wait()
+    return len(upserts), len(deletes)
+
+
+def upload_in_order(index, objects, top_percent):
+    """ save the first top_percent of objects and wait for them before saving
+    the rest. Returns the seconds until the top and all objects were indexed."""
+    top = max(1, math.ceil(len(objects) * top_percent / 100))
+    start = time.perf_counter()
+    index.save_objects(objects[:top]).wait()
+    top_seconds = time.perf_counter() - start
+    if objects[top:]:
+        index.save_objects(objects[top:]).wait()
+    return top_seconds, time.perf_counter() - start
+
+
+def temporary_index_prefix(algolia_index_name):
+    return f"{algolia_index_name}_tmp_"
+
+
+def delete_temporary_indices(client, index_names, algolia_index_name, now=None):
+    """ delete the temporary indices left behind by failed rebuilds, those
+    named <index>_tmp_<timestamp> and older than REBUILD_STALE_SECONDS."""
+    now = time.time() if now is None else now
+    pattern = re.compile(re.escape(temporary_index_prefix(algolia_index_name)) + r"(\d+)$")
+    stale = []
+    for name in index_names:
+        match = pattern.match(name)
+        if match and now - int(match.group(1)) >= REBUILD_STALE_SECONDS:
+            stale.append(name)
+    for name in stale:
+        client.init_index(name).delete().wait()
+    return stale
+
+
+def rebuild_index(client, algolia_index_name, objects, workers=REBUILD_WORKERS):
+    """ upload objects into a fresh temporary index, check every record made it
+    and move it over the live index. The live index is untouched on failure."""
+    if not objects:
+        raise ValueError(f"Refusing to replace index '{algolia_index_name}' with no objects")
+    index_names = [item["name"] for item in client.list_indices()["items"]]
+    stale = delete_temporary_indices(client, index_names, algolia_index_name)
+    if stale:
+        print_to_stderr(f"Deleted leftover temporary indices: {', '.join(stale)}")
+    temporary_name = f"{temporary_index_prefix(algolia_index_name)}{int(time.time())}"
+    temporary = client.init_index(temporary_name)
+    try:
+        if algolia_index_name in index_names:
+            client.copy_index(algolia_index_name, temporary_name,
+                              {"scope": REBUILD_COPY_SCOPE}).wait()
+        batches = [objects[i:i + REBUILD_BATCH_SIZE]
+                   for i in range(0, len(objects), REBUILD_BATCH_SIZE)]
+        with ThreadPoolExecutor(workers) as executor:
+            # list() re-raises the first failed batch.
+            list(executor.map(lambda batch: temporary.save_objects(batch).wait(), batches))
+        expected = len({algolia_object["objectID"] for algolia_object in objects})
+        # The copied settings may group records by url, count every record.
+        count = temporary.search("", {"hitsPerPage": 0, "distinct": False})["nbHits"]
+        if count != expected:
+            raise RuntimeError(
+                f"Temporary index '{temporary_name}' has {count} objects, expected {expected}")
+        client.move_index(temporary_name, algolia_index_name).wait()
+    except Exception:
+        temporary.delete().wait()
+        raise
+    return expected
+
+
+def rebuild(algolia_index_name, algolia_app_id, algolia_api_key, json_file):
+    client = SearchClient.create(algolia_app_id, algolia_api_key)
+
+    with open(json_file) as f:
+        objects = with_content_hash(json_codec.load(f))
+
+    print_to_stderr(f"Rebuilding index with {len(objects)} objects...")
+    return rebuild_index(client, algolia_index_name, objects)
+
+
+def load(algolia_index_name, algolia_app_id, algolia_api_key, json_file,
+         top_percent=None):
     # Load the Algolia API client
     client = SearchClient.create(algolia_app_id, algolia_api_key)
     index = client.init_index(algolia_index_name)
 
     # Load the JSON file
     with open(json_file) as f:
-        objects = json.load(f)
+        objects = with_content_hash(json_codec.load(f))
 
     # Push the objects to Algolia
     print_to_stderr(f"Loading {len(objects)} objects...")
-    # first just send 10 objects
-    index.save_objects(objects).wait()
+    if top_percent is None:
+        index.save_objects(objects).wait()
+    elif objects:
+        top_seconds, seconds = upload_in_order(index, objects, float(top_percent))
+        print_to_stderr(f"Top {top_percent}% of objects searchable after "
+                        f"{top_seconds:.1f}s, all {len(objects)} after {seconds:.1f}s")
 
     return len(objects)
 
 
-# Main function
-if __name__ == "__main__":
-    # Parse arguments
-    arguments = docopt(help)
-    debug_log(arguments)
-    algolia_index_name = arguments['<algolia-index-name>']
-    json_file = arguments['<algolia-json-file>']
-
+def main(json_file, algolia_index_name, reconcile_index=False, dry_run=False,
+         top_percent=None, rebuild_index=False, scope_file=None, scope_facets=False):
     # Get environment variables
     algolia_app_id = os.environ.get('ALGOLIA_APP_ID')
     algolia_api_key = os.environ.get('ALGOLIA_API_KEY')
 
-    # Load the objects into Algolia
-    count = load(algolia_index_name, algolia_app_id,
-                 algolia_api_key, json_file)
+    if scope_facets:
+        added = setup_scope_facets(algolia_index_name, algolia_app_id, algolia_api_key)
+        if added:
+            print(f"Made {', '.join(added)} filterable in index '{algolia_index_name}'")
+        else:
+            print(f"Index '{algolia_index_name}' can already filter on {', '.join(SCOPE_FACETS)}")
+    elif reconcile_index:
+        upserts, deletes = reconcile(algolia_index_name, algolia_app_id,
+                                     algolia_api_key, json_file, dry_run, scope_file)
+        if dry_run:
+            print(f"Would upsert {upserts} and delete {deletes} objects in index '{algolia_index_name}'")
+        else:
+            print(f"Upserted {upserts} and deleted {deletes} objects in index '{algolia_index_name}'")
+    elif rebuild_index:
+        count = rebuild(algolia_index_name, algolia_app_id,
+                        algolia_api_key, json_file)
+        print(f"Rebuilt index '{algolia_index_name}' with {count} objects")
+    else:
+        # Load the objects into Algolia
+        count = load(algolia_index_name, algolia_app_id,
+                     algolia_api_key, json_file, top_percent)
 
-    # Print summary
-    print(f"Loaded {count} objects into index '{algolia_index_name}'")
+        # Print summary
+        print(f"Loaded {count} objects into index '{algolia_index_name}'")
+
+
+# Main function
+if __name__ == "__main__":
+    # Parse arguments
+    arguments = docopt(help)
+    debug_log(arguments)
+    main(arguments['<algolia-json-file>'], arguments['<algolia-index-name>'],
+         arguments['--reconcile'], arguments['--dry-run'],
+         arguments['--top-percent'], arguments['--rebuild'],
+         arguments['--scope-file'], arguments['--setup-scope-facets'])
@@ -0,0 +1,54 @@
+from src.quarantine import DEFAULT_MAX_HTML_BYTES, DEFAULT_MAX_RECORDS
+
+# The docopt description of every command line option, shared by the stage
+# scripts and src/cli.py so each option is documented in one place. Keep this
+# module free of heavy imports, src/cli.py reads it before any stage runs.
+OPTIONS = {
+    "--discourse-url=<discourse-url>": "The base url of the discourse forum.",
+    "--lvl0=<lvl0>": "The top level category name to nest all search results under. [default: Forum]",
+    "--tag=<tag>": "The tags to add to all algolia objects. [default: community]",
+    "--staging-db=<file>": "Use this SQLite staging database: extract upserts posts and categories into it page by page, transform reads them from it.",
+    "--full-payload": "Keep every field Discourse returns, for debugging, not only those the transform and incremental runs use.",
+    "--compact": "Write compact json instead of pretty printing it.",
+    "--since=<timestamp>": "Only posts updated at or after this ISO 8601 time, e.g. 2023-06-01.",
+    "--until=<timestamp>": "Only posts updated before this ISO 8601 time.",
+    "--topic=<topic-id>": "Only the posts of this topic.",
+    "--category=<category-id>": "Only the posts of the topics in this category.",
+    "--scope-file=<file>": "Transform writes the scope and the urls of its posts to this json file, and a reconcile only touches the records in that scope.",
+    "--dedup=<mode>": "Suppress sections repeated across posts: \"drop\" every copy or keep only the \"first\".",
+    "--dedup-min-posts=<n>": "How many posts a section must be in to be suppressed. [default: 10]",
+    "--pack-bytes=<n>": "Merge adjacent paragraphs under the same header into records of up to this many bytes of text.",
+    "--max-html-bytes=<n>": f"Posts with more html than this are quarantined. [default: {DEFAULT_MAX_HTML_BYTES}]",
+    "--max-parse-seconds=<s>": "Quarantine posts that take longer than this to parse. Off by default, as it depends on machine load.",
+    "--max-post-records=<n>": f"Posts that would make more records than this are quarantined. [default: {DEFAULT_MAX_RECORDS}]",
+    "--quarantine-report=<file>": "Write the urls of quarantined posts and why to this json file.",
+    "--priority=<spec>": "Transform and output the highest scoring posts first, weighing \"recency\", \"accepted\", \"reads\" and \"score\", e.g. recency=2,accepted.",
+    "--reconcile": "Apply only the differences between the file and the index.",
+    "--dry-run": "Report what reconcile would change without changing it.",
+    "--top-percent=<p>": "Upload the first p percent of the records and wait until they are searchable before uploading the rest.",
+    "--rebuild": "Replace the index through a temporary index and an atomic move.",
+    "--setup-scope-facets": "Make topic_id and category_id filterable, once per index, so a topic or category can be reconciled.",
+    "--data-dir=<dir>": "Where fanout keeps each job's discourse and algolia json. [default: .]",
+}
+
+EXTRACT_OPTIONS = ["--staging-db=<file>", "--full-payload", "--compact",
+                   "--since=<timestamp>", "--until=<timestamp>", "--topic=<topic-id>",
+                   "--category=<category-id>"]
+
+TRANSFORM_OPTIONS = ["--discourse-url=<discourse-url>", "--lvl0=<lvl0>", "--tag=<tag>",
+                     "--staging-db=<file>", "--since=<timestamp>", "--until=<timestamp>",
+                     "--topic=<topic-id>", "--category=<category-id>", "--scope-file=<file>",
+                     "--dedup=<mode>", "--dedup-min-posts=<n>", "--pack-bytes=<n>",
+                     "--max-html-bytes=<n>", "--max-parse-seconds=<s>", "--max-post-records=<n>",
+                     "--quarantine-report=<file>", "--priority=<spec>", "--compact"]
+
+LOAD_OPTIONS = ["--reconcile", "--dry-run", "--scope-file=<file>", "--top-percent=<p>", "--rebuild",
+                "--setup-scope-facets"]
+
+FANOUT_OPTIONS = ["--data-dir=<dir>"]
+
+
+def options_help(options):
+    """ the docopt Options lines of `options`, descriptions aligned in one column."""
+    width = max(len(option) for option in options) + 2
+    return "\n".join(f"    {option:<{width}}{OPTIONS[option]}" for option in options)
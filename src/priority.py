@@ -0,0 +1,70 @@
+from datetime import datetime
+
+# What a --priority spec can weigh, each scored from 0 to 1.
+PRIORITY_FACTORS = [
+    "recency",   # how recently the post was updated, halving every 30 days.
+    "accepted",  # 1 if the topic has an accepted answer.
+    "reads",     # how often the post was read, 0.5 at 100 reads.
+    "score",     # Discourse's post score, 0.5 at a score of 20.
+]
+
+RECENCY_HALF_LIFE_DAYS = 30
+READS_HALF_SCORE = 100
+SCORE_HALF_SCORE = 20
+
+
+def parse_priority(spec):
+    """ parse "recency=2,accepted,reads=0.5" into factor weights, a factor
+    without a weight counts once."""
+    weights = {}
+    for term in spec.split(","):
+        factor, _, weight = term.strip().partition("=")
+        if factor not in PRIORITY_FACTORS:
+            raise ValueError(
+                f"Unknown priority factor '{factor}', use some of {PRIORITY_FACTORS}")
+        weights[factor] = float(weight) if weight else 1.0
+    return weights
+
+
+def parse_timestamp(timestamp):
+    # Discourse timestamps end in Z, which fromisoformat only accepts from 3.11.
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def saturate(value, half_score):
+    value = max(value or 0, 0)
+    return value / (value + half_score)
+
+
+class PostPriority:
+    """ orders posts by a weighted score so the most valuable ones are
+    transformed, and then loaded, first."""
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def score(self, post, newest):
+        """ newest is the latest updated_at of the run, recency is relative to
+        it so the order doesn't depend on when the run happens."""
+        return sum(weight * self._factor(factor, post, newest)
+                   for factor, weight in self.weights.items())
+
+    def _factor(self, factor, post, newest):
+        if factor == "recency":
+            if not post.get("updated_at"):
+                return 0.0
+            age = newest - parse_timestamp(post["updated_at"])
+            return 0.5 ** (age.total_seconds() / 86400 / RECENCY_HALF_LIFE_DAYS)
+        if factor == "accepted":
+            return 1.0 if post.get("topic_accepted_answer") else 0.0
+        if factor == "reads":
+            return saturate(post.get("reads"), READS_HALF_SCORE)
+        return saturate(post.get("score"), SCORE_HALF_SCORE)
+
+    def order(self, posts):
+        """ returns the posts highest score first. Ties keep their order."""
+        posts = list(posts)
+        timestamps = [parse_timestamp(post["updated_at"])
+                      for post in posts if post.get("updated_at")]
+        newest = max(timestamps, default=None)
+        return sorted(posts, key=lambda post: -self.score(post, newest))
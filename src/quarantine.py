@@ -0,0 +1,87 @@
+from html import unescape
+import math
+import re
+
+from src import json_codec
+
+# The fallback keeps this much text, which fits in a single record even with
+# the content_camel copy.
+FALLBACK_TEXT_BYTES = 4000
+
+# The deterministic limits every transform applies unless told otherwise.
+DEFAULT_MAX_HTML_BYTES = 500000
+DEFAULT_MAX_RECORDS = 200
+
+TAGS = re.compile(r"<[^>]*>")
+WHITESPACE = re.compile(r"\s+")
+
+
+def truncate_utf8(text, max_bytes):
+    return text.encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
+
+
+class PostBudget:
+    """ per-post limits on html size, parse time and number of records. Posts
+    over a limit are indexed through a cheap, truncated fallback instead and
+    recorded in `quarantined` so they can be looked at later."""
+
+    def __init__(self, max_html_bytes=None, max_parse_seconds=None, max_records=None):
+        self.max_html_bytes = max_html_bytes
+        self.max_parse_seconds = max_parse_seconds
+        self.max_records = max_records
+        self.quarantined = []
+
+    @classmethod
+    def with_default_limits(cls):
+        """ the html size and record limits, without a parse time limit as
+        which posts that catches depends on machine load."""
+        return cls(DEFAULT_MAX_HTML_BYTES, None, DEFAULT_MAX_RECORDS)
+
+    def quarantine(self, url, reason, detail):
+        self.quarantined.append({"url": url, "reason": reason, "detail": detail})
+
+    def html_too_large(self, html):
+        return (self.max_html_bytes is not None
+                and len(html.encode('utf-8')) > self.max_html_bytes)
+
+    def parse_too_slow(self, seconds):
+        return self.max_parse_seconds is not None and seconds > self.max_parse_seconds
+
+    def fallback_sections(self, html):
+        """ strip tags with a regex instead of parsing, and keep only the start
+        of the text. Same shape as _simple_html_parse."""
+        # Tags can't be longer than the html itself, so this bounds the work.
+        html = truncate_utf8(html, FALLBACK_TEXT_BYTES * 4)
+        text = unescape(WHITESPACE.sub(" ", TAGS.sub(" ", html))).strip()
+        text = truncate_utf8(text, FALLBACK_TEXT_BYTES)
+        return [{"element": "p", "text": text}] if text else []
+
+    def limit_records(self, url, sections, record_size_limit):
+        """ truncate [(position, text, html_type)] so they split into at most
+        max_records records, estimating the splits from the text size."""
+        if self.max_records is None:
+            return sections
+        limited = []
+        estimated = 0
+        for position, text, html_type in sections:
+            # Content is stored twice per record (content and content_camel).
+            size = 2 * len(text.encode('utf-8'))
+            records = max(1, math.ceil(size / record_size_limit))
+            if estimated + records > self.max_records:
+                remaining = self.max_records - estimated
+                if remaining > 0:
+                    text = truncate_utf8(text, remaining * record_size_limit // 2)
+                    limited.append((position, text, html_type))
+                self.quarantine(url, "records",
+                                f"more than {self.max_records} records")
+                return limited
+            estimated += records
+            limited.append((position, text, html_type))
+        return limited
+
+    def summary(self):
+        return f"Quarantined {len(self.quarantined)} posts that exceeded the parse budget."
+
+    def write_report(self, report_file):
+        with open(report_file, "w") as f:
+            json_codec.dump(self.quarantined, f, indent=2)
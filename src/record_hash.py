@@ -0,0 +1,19 @@
+from hashlib import sha1
+
+from src import json_codec
+
+# Stored on every record so reconcile can tell if it changed without
+# downloading the whole record.
+CONTENT_HASH_ATTRIBUTE = "content_hash"
+
+
+def content_hash(algolia_object):
+    contents = {key: value for key, value in algolia_object.items()
+                if key != CONTENT_HASH_ATTRIBUTE}
+    return sha1(json_codec.canonical(contents, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def with_content_hash(objects):
+    for algolia_object in objects:
+        algolia_object[CONTENT_HASH_ATTRIBUTE] = content_hash(algolia_object)
+    return objects
@@ -0,0 +1,112 @@
+from datetime import timedelta, timezone
+import re
+
+from src import json_codec
+from src.priority import parse_timestamp
+
+# The topic id in a post url, /t/<slug>/<topic-id>/<post-number>.
+POST_URL_TOPIC_ID = re.compile(r"/t/[^/]+/(\d+)/\d+$")
+
+
+def topic_id_from_url(url):
+    match = POST_URL_TOPIC_ID.search(url or "")
+    return int(match.group(1)) if match else None
+
+
+def parse_time(timestamp):
+    """ an ISO 8601 time as a UTC datetime, times without an offset are UTC."""
+    time = parse_timestamp(timestamp)
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.astimezone(timezone.utc)
+
+
+def normalize_time(timestamp):
+    """ an ISO 8601 time in Discourse's format, 2023-06-01T12:00:00.000Z, so it
+    compares as text with stored timestamps. Rounded up to the millisecond,
+    which keeps `>=` and `<` exact against Discourse's millisecond times."""
+    time = parse_time(timestamp)
+    if time.microsecond % 1000:
+        time += timedelta(microseconds=1000 - time.microsecond % 1000)
+    return f"{time:%Y-%m-%dT%H:%M:%S}.{time.microsecond // 1000:03d}Z"
+
+
+class Scope:
+    """ the posts a partial run covers: updated in [since, until), in one
+    topic and in one category, whichever are set. Timestamps are ISO 8601 and
+    compared as strings, like the staging store does. A scope with nothing set
+    is the whole forum."""
+
+    def __init__(self, since=None, until=None, topic_id=None, category_id=None):
+        # Exact for contains(), and normalized for the store and scope file.
+        self._since_time = parse_time(since) if since is not None else None
+        self._until_time = parse_time(until) if until is not None else None
+        self.since = normalize_time(since) if since is not None else None
+        self.until = normalize_time(until) if until is not None else None
+        self.topic_id = int(topic_id) if topic_id is not None else None
+        self.category_id = int(category_id) if category_id is not None else None
+
+    def __bool__(self):
+        return any(value is not None for value in self.to_dict().values())
+
+    def __str__(self):
+        if not self:
+            return "the whole forum"
+        parts = []
+        if self.topic_id is not None:
+            parts.append(f"topic {self.topic_id}")
+        if self.category_id is not None:
+            parts.append(f"category {self.category_id}")
+        if self.since is not None:
+            parts.append(f"updated since {self.since}")
+        if self.until is not None:
+            parts.append(f"updated before {self.until}")
+        return ", ".join(parts)
+
+    def to_dict(self):
+        return {"since": self.since, "until": self.until,
+                "topic_id": self.topic_id, "category_id": self.category_id}
+
+    def contains(self, post):
+        if self.since is not None or self.until is not None:
+            if not post.get("updated_at"):
+                return False
+            updated_at = parse_time(post["updated_at"])
+            if self.since is not None and updated_at < self._since_time:
+                return False
+            if self.until is not None and updated_at >= self._until_time:
+                return False
+        return ((self.topic_id is None or post.get("topic_id") == self.topic_id)
+                and (self.category_id is None or post.get("category_id") == self.category_id))
+
+    def record_filters(self):
+        """ an Algolia filters string for the records of the topic and
+        category, None without either. Records don't hold updated_at, so
+        contains_record() still checks the time window."""
+        filters = [f"{attribute}:{value}" for attribute, value in [
+            ("topic_id", self.topic_id), ("category_id", self.category_id)]
+            if value is not None]
+        return " AND ".join(filters) or None
+
+    def contains_record(self, url, post_urls):
+        """ whether an indexed record belongs to the scope, given the urls of
+        the posts the transform found in it. A scope of only a topic also
+        covers the records of posts deleted from it since."""
+        if not self or url in post_urls:
+            return True
+        whole_topic = (self.topic_id is not None and self.category_id is None
+                       and self.since is None and self.until is None)
+        return whole_topic and topic_id_from_url(url) == self.topic_id
+
+
+def write_scope_file(scope_file, scope, post_urls):
+    with open(scope_file, "w") as f:
+        json_codec.dump(dict(scope.to_dict(), post_urls=post_urls), f, indent=2)
+
+
+def read_scope_file(scope_file):
+    """ returns (Scope, set of post urls)."""
+    with open(scope_file) as f:
+        data = json_codec.load(f)
+    post_urls = set(data.pop("post_urls"))
+    return Scope(**data), post_urls
@@ -0,0 +1,109 @@
+import sqlite3
+
+from src import json_codec
+from src.scope import normalize_time
+
+# Rows are read in batches so large archives never need to fit in memory.
+FETCH_BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    topic_id INTEGER NOT NULL,
+    category_id INTEGER,
+    post_number INTEGER,
+    updated_at TEXT,
+    version INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_topic_id ON posts (topic_id);
+CREATE INDEX IF NOT EXISTS posts_category_id ON posts (category_id);
+CREATE INDEX IF NOT EXISTS posts_updated_at ON posts (updated_at);
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class StagingStore:
+    """ a local SQLite copy of the raw Discourse posts and categories, keyed by
+    id. Extract upserts into it, and the transform can query just the posts it
+    needs instead of scanning a whole discourse.json."""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def upsert_posts(self, posts):
+        """ insert or replace posts by id, returns how many were written."""
+        rows = [(post["id"], post["topic_id"], post.get("category_id"),
+                 post.get("post_number"), post.get("updated_at"),
+                 post.get("version"), json_codec.dumps(post)) for post in posts]
+        with self._connection:
+            self._connection.executemany(
+                """INSERT INTO posts (id, topic_id, category_id, post_number,
+                                      updated_at, version, data)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (id) DO UPDATE SET
+                       topic_id = excluded.topic_id,
+                       category_id = excluded.category_id,
+                       post_number = excluded.post_number,
+                       updated_at = excluded.updated_at,
+                       version = excluded.version,
+                       data = excluded.data""", rows)
+        return len(rows)
+
+    def upsert_categories(self, categories):
+        rows = [(category["id"], json_codec.dumps(category)) for category in categories]
+        with self._connection:
+            self._connection.executemany(
+                """INSERT INTO categories (id, data) VALUES (?, ?)
+                   ON CONFLICT (id) DO UPDATE SET data = excluded.data""", rows)
+        return len(rows)
+
+    def categories(self):
+        rows = self._connection.execute(
+            "SELECT data FROM categories ORDER BY id")
+        return [json_codec.loads(data) for (data,) in rows]
+
+    def count_posts(self):
+        return self._connection.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def posts(self, since=None, topic_id=None, category_id=None, until=None):
+        """ yield posts, newest first like posts.json, optionally only those
+        updated at or after `since` and before `until` (ISO 8601 times, any
+        offset), in one topic or in one category."""
+        conditions = []
+        parameters = []
+        if since is not None:
+            conditions.append("updated_at >= ?")
+            parameters.append(normalize_time(since))
+        if until is not None:
+            conditions.append("updated_at < ?")
+            parameters.append(normalize_time(until))
+        if topic_id is not None:
+            conditions.append("topic_id = ?")
+            parameters.append(int(topic_id))
+        if category_id is not None:
+            conditions.append("category_id = ?")
+            parameters.append(int(category_id))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self._connection.execute(
+            f"SELECT data FROM posts {where} ORDER BY id DESC", parameters)
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                return
+            for (data,) in rows:
+                yield json_codec.loads(data)
@@ -1,10 +1,21 @@
 #!/usr/bin/env python3
 from bs4 import BeautifulSoup
-from fluent_discourse import Discourse
-import json
 from docopt import docopt
 from hashlib import sha1
+import os
 import sys
+import time
+
+if __package__ in (None, ""):
+    # Run as src/transform_discourse_to_algolia.py, make the src package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import json_codec  # noqa: E402
+from src.dedup import SectionDeduplicator  # noqa: E402
+from src.options import TRANSFORM_OPTIONS, options_help  # noqa: E402
+from src.priority import PostPriority, parse_priority  # noqa: E402
+from src.quarantine import DEFAULT_MAX_HTML_BYTES, DEFAULT_MAX_RECORDS, PostBudget  # noqa: E402
+from src.scope import Scope, write_scope_file  # noqa: E402
+from src.staging import StagingStore  # noqa: E402
 
 
 def print_to_stderr(*a, **k):
@@ -15,17 +26,20 @@ debug = False
 debug_log = print_to_stderr if debug else lambda *a, **k: None
 
 # DocOpt definition of the command line interface.
-help = """
+help = f"""
 Transform posts from discourse to algolia-style. Input is expected to be json on
-stdin and output is json on stdout. Allow multiple tags to be specified.
+stdin, or a staging database, and output is json on stdout. Allow multiple tags
+to be specified.
+
+With --since, --until, --topic or --category only the posts in that scope are
+transformed. The scope and its post urls can be written to a scope file, so
+that `load-algolia --reconcile --scope-file` replaces only the scope's records.
 
 Usage:
-    transform-discourse-to-algolia --discourse-url=<discourse-url> --lvl0=<lvl0>  --tag=<tag>...
+    transform-discourse-to-algolia --discourse-url=<discourse-url> --lvl0=<lvl0>  --tag=<tag>... [--staging-db=<file>] [--since=<timestamp>] [--until=<timestamp>] [--topic=<topic-id>] [--category=<category-id>] [--scope-file=<file>] [--dedup=<mode> [--dedup-min-posts=<n>]] [--pack-bytes=<n>] [--max-html-bytes=<n>] [--max-parse-seconds=<s>] [--max-post-records=<n>] [--quarantine-report=<file>] [--priority=<spec>] [--compact]
 
 Options:
-    --discourse-url=<discourse-url>  The base url of the discourse forum.
-    --lvl0=<lvl0>                    The top level category name to nest all search results under. [default: Forum]
-    --tag=<tag>                      The tags to add to all algolia objects. [default: community]
+{options_help(TRANSFORM_OPTIONS)}
 """
 
 # Python's version of JSON's null
@@ -34,6 +48,9 @@ null = None
 # Algolia's Record Size Limits
 ALGOLIA_OBJECT_SIZE_LIMIT = 10000
 
+# Joins the text of sections merged by --pack-bytes.
+PACKED_SECTION_SEPARATOR = "\n"
+
 HTML_TYPES_EXCLUDED_FROM_INDEX = [
     "aside",
     "img",
@@ -72,23 +89,101 @@ ALGOLIA_WEIGHT_FOR_TYPE = {
 class TransformDiscourseToAlgolia:
     # inspired by get_records_from_dom: https://github.com/algolia/docsearch-scraper/blob/70509a564fe76b34ab28a81189ee5abd99b1a440/scraper/src/strategies/default_strategy.py#L63
 
-    def __init__(self, discourse_url, raw_categories, raw_posts, lvl0, tags):
+    def __init__(self, discourse_url, raw_categories, raw_posts, lvl0, tags,
+                 deduplicator=None, pack_bytes=None, budget=None, priority=None,
+                 scope=None):
         self.base_url = discourse_url
+        # Optional SectionDeduplicator for text repeated across many posts.
+        self.deduplicator = deduplicator
+        # Optional text budget for merging small adjacent sections.
+        if pack_bytes is not None and not 0 < pack_bytes < ALGOLIA_OBJECT_SIZE_LIMIT:
+            raise ValueError(
+                f"pack_bytes must be between 0 and {ALGOLIA_OBJECT_SIZE_LIMIT}, not {pack_bytes}")
+        self.pack_bytes = pack_bytes
+        # Optional PostBudget to quarantine pathological posts.
+        self.budget = budget
+        # Optional Scope, posts outside it are dropped before parsing.
+        self.scope = scope or None
+        # The urls of the posts in scope, including skipped ones, so the load
+        # can tell which indexed records the scope covers.
+        self.scope_urls = []
+        # raw_posts may be a generator, so count them as they go by.
+        self.post_count = 0
         self._public_categories = self.transform_categories(raw_categories)
+        # Optional PostPriority, the records follow the order of the posts.
+        if priority is not None:
+            raw_posts = priority.order(raw_posts)
         self.algolia_objects = self._transform_posts(
             self._public_categories, raw_posts, lvl0, tags)
 
+    @classmethod
+    def from_staging(cls, discourse_url, store, lvl0, tags,
+                     since=None, topic_id=None, category_id=None, until=None,
+                     **options):
+        """ transform the posts of a StagingStore that match the query, reading
+        them in batches rather than all at once."""
+        scope = Scope(since, until, topic_id, category_id)
+        return cls(discourse_url, store.categories(),
+                   store.posts(since, topic_id, category_id, until), lvl0, tags,
+                   scope=scope, **options)
+
     def _transform_posts(self, categories, discourse_posts, lvl0, tags):
         algolia_objects = []
+        parsed_posts = self._parse_posts(categories, discourse_posts)
+        if self.deduplicator is not None:
+            # Count repeated sections across all posts before making records.
+            parsed_posts = list(parsed_posts)
+            for post, html_elements in parsed_posts:
+                self.deduplicator.add(post["id"], [
+                    section["text"] for section in html_elements
+                    if self._is_content(section)])
+        for post, html_elements in parsed_posts:
+            objects = self._transform_post(
+                post, lvl0, tags, categories, html_elements)
+            algolia_objects.extend(objects)
+        return algolia_objects
+
+    def _parse_posts(self, categories, discourse_posts):
         # Iterate over all_posts
         for post in discourse_posts:
+            if self.scope is not None:
+                if not self.scope.contains(post):
+                    continue
+                self.scope_urls.append(self.post_url(post, self.base_url))
+            self.post_count += 1
             if self.should_skip_post(post, categories):
                 continue
-            objects = self._transform_post(post, lvl0, tags, categories)
-            algolia_objects.extend(objects)
-        return algolia_objects
+            yield post, self._parse_post(post)
 
-    def _transform_post(self, post, lvl0, base_tags, categories):
+    def _parse_post(self, post):
+        html = post["cooked"]
+        if self.budget is None:
+            return self._simple_html_parse(html)
+        url = self.post_url(post, self.base_url)
+        if self.budget.html_too_large(html):
+            self.budget.quarantine(url, "html_bytes",
+                                   f"{len(html.encode('utf-8'))} bytes of html")
+            return self.budget.fallback_sections(html)
+        start = time.perf_counter()
+        try:
+            html_elements = self._simple_html_parse(html)
+        except RecursionError:
+            self.budget.quarantine(url, "parse_error", "html is nested too deeply")
+            return self.budget.fallback_sections(html)
+        seconds = time.perf_counter() - start
+        if self.budget.parse_too_slow(seconds):
+            # The time is already spent, but a slow parse usually means a
+            # huge tree that is just as slow to split into records.
+            self.budget.quarantine(url, "parse_seconds", f"parsed in {seconds:.2f}s")
+            return self.budget.fallback_sections(html)
+        return html_elements
+
+    def _is_content(self, section):
+        html_type = section["element"]
+        return (html_type not in HTML_TYPES_EXCLUDED_FROM_INDEX and
+                ALGOLIA_TYPE_FROM_HTML_TYPE.get(html_type, "content") == "content")
+
+    def _transform_post(self, post, lvl0, base_tags, categories, html_elements=None):
         algolia_objects = []
         lvl1 = categories[post["category_id"]]
         lvl2 = post["topic_title"]
@@ -96,23 +191,68 @@ class TransformDiscourseToAlgolia:
         if post["topic_accepted_answer"]:
             tags.append("answered")
         url = self.post_url(post, self.base_url)
+        # Filterable, so a scoped reconcile only browses the scope's records.
+        post_ids = {"topic_id": post["topic_id"], "category_id": post["category_id"]}
         # Break up post into sections
-        html_elements = self._simple_html_parse(post["cooked"])
+        if html_elements is None:
+            html_elements = self._simple_html_parse(post["cooked"])
+        sections = []
         for index, section in enumerate(html_elements):
             text = section["text"]
             html_type = section["element"]
             if (not text or text == '' or html_type in HTML_TYPES_EXCLUDED_FROM_INDEX):
                 continue
+            # Positions are kept even when a section is dropped so the
+            # objectIDs of the rest don't change.
+            if (self.deduplicator is not None and self._is_content(section)
+                    and not self.deduplicator.keep(post["id"], text)):
+                continue
             if (html_type not in ALGOLIA_TYPE_FROM_HTML_TYPE):
                 print_to_stderr(
                     f"WARN: This is content, right? Unknown html element: {html_type}: {text}")
                 html_type = "p"
+            sections.append((index, text, html_type))
+        if self.pack_bytes:
+            content_hierarchy = {"lvl0": lvl0, "lvl1": lvl1, "lvl2": lvl2, "lvl3": null}
+
+            def fits(text, position):
+                return not self._object_length_too_long(self._algolia_object(
+                    text, tags, "content", url, content_hierarchy, position, 0, post_ids))
+            sections = self._pack_sections(sections, fits)
+        if self.budget is not None:
+            sections = self.budget.limit_records(
+                url, sections, ALGOLIA_OBJECT_SIZE_LIMIT)
+        for index, text, html_type in sections:
             objects = self._transform_section(
-                lvl0, lvl1, lvl2, tags, url, text, html_type, index)
+                lvl0, lvl1, lvl2, tags, url, text, html_type, index, post_ids)
             algolia_objects.extend(objects)
         return algolia_objects
 
-    def _transform_section(self, lvl0, lvl1, lvl2, tags, url, text, html_type, position):
+    def _pack_sections(self, sections, fits):
+        """ merge runs of consecutive content sections into one section of at
+        most pack_bytes of text, and only while fits(text, position) says the
+        merged record is under the size limit, so packing never causes a
+        split. A header ends the run. The merged section keeps the position
+        of its first section, so objectIDs stay deterministic."""
+        packed = []
+        run_size = 0
+        for index, text, html_type in sections:
+            size = len(text.encode('utf-8'))
+            is_content = ALGOLIA_TYPE_FROM_HTML_TYPE[html_type] == "content"
+            previous = packed[-1] if packed else None
+            if (is_content and previous is not None
+                    and ALGOLIA_TYPE_FROM_HTML_TYPE[previous[2]] == "content"
+                    and run_size + len(PACKED_SECTION_SEPARATOR) + size <= self.pack_bytes
+                    and fits(previous[1] + PACKED_SECTION_SEPARATOR + text, previous[0])):
+                packed[-1] = (previous[0], previous[1] + PACKED_SECTION_SEPARATOR + text, "p")
+                run_size += len(PACKED_SECTION_SEPARATOR) + size
+            else:
+                packed.append((index, text, html_type))
+                run_size = size
+        return packed
+
+    def _transform_section(self, lvl0, lvl1, lvl2, tags, url, text, html_type, position,
+                           post_ids=None):
         algolia_objects = []
         algolia_type = ALGOLIA_TYPE_FROM_HTML_TYPE[html_type]
         lvl3 = text if algolia_type == "lvl3" else null
@@ -124,16 +264,35 @@ class TransformDiscourseToAlgolia:
             "lvl3": lvl3,
         }
         objects = self._create_objects(
-            content, tags, algolia_type, url, hierarchy, position, 0)
+            content, tags, algolia_type, url, hierarchy, position, 0, post_ids)
         algolia_objects.extend(objects)
         return algolia_objects
 
-    def _create_objects(self, content_chunk, tags, algolia_type, url, hierarchy, position, chunk_start):
+    def _create_objects(self, content_chunk, tags, algolia_type, url, hierarchy, position, chunk_start,
+                        post_ids=None):
+        algolia_object = self._algolia_object(
+            content_chunk, tags, algolia_type, url, hierarchy, position, chunk_start, post_ids)
+
+        if self._object_length_too_long(algolia_object):
+            # Split the content into two chunks and recurse
+            chunk_end = int(len(content_chunk) / 2)
+            first_chunk = content_chunk[:chunk_end]
+            second_chunk = content_chunk[chunk_end:]
+            objects = self._create_objects(
+                first_chunk, tags, algolia_type, url, hierarchy, position, chunk_start, post_ids)
+            objects.extend(self._create_objects(
+                second_chunk, tags, algolia_type, url, hierarchy, position, chunk_end, post_ids))
+            return objects
+        return [algolia_object]
+
+    def _algolia_object(self, content_chunk, tags, algolia_type, url, hierarchy, position, chunk_start,
+                        post_ids=None):
         algolia_object = {
             "content": content_chunk,
             "tags": tags,
             "type": algolia_type,
             "url": url,
+            **(post_ids or {}),
             "hierarchy": hierarchy,
             "weight": {
                 "level": ALGOLIA_WEIGHT_FOR_TYPE[algolia_type],
@@ -143,27 +302,16 @@ class TransformDiscourseToAlgolia:
         algolia_object['hierarchy_camel'] = (algolia_object['hierarchy'],)
         algolia_object['content_camel'] = algolia_object['content']
         # objectID should be unique and deterministic
-        algolia_object["objectID"] = sha1(json.dumps(
+        algolia_object["objectID"] = sha1(json_codec.canonical(
             [url, hierarchy, position, chunk_start]).encode('utf-8')).hexdigest()
-
-        if self._object_length_too_long(algolia_object):
-            # Split the content into two chunks and recurse
-            chunk_end = int(len(content_chunk) / 2)
-            first_chunk = content_chunk[:chunk_end]
-            second_chunk = content_chunk[chunk_end:]
-            objects = self._create_objects(
-                first_chunk, tags, algolia_type, url, hierarchy, position, chunk_start)
-            objects.extend(self._create_objects(
-                second_chunk, tags, algolia_type, url, hierarchy, position, chunk_end))
-            return objects
-        return [algolia_object]
+        return algolia_object
 
     def _object_length_too_long(self, algolia_object):
-        return len(json.dumps(algolia_object)) > ALGOLIA_OBJECT_SIZE_LIMIT
+        return len(json_codec.canonical(algolia_object)) > ALGOLIA_OBJECT_SIZE_LIMIT
 
     def transform_categories(self, raw_categories):
         # Pretty print
-        # debug_log(json.dumps(raw_categories, indent=4, sort_keys=True))
+        # debug_log(json_codec.dumps(raw_categories, indent=4, sort_keys=True))
         categories = {}
         if not raw_categories:
             return categories
@@ -207,21 +355,51 @@ class TransformDiscourseToAlgolia:
         return sections
 
 
-def main(input_textio, output_textio, discourse_url, lvl0, tags):
-    # Read input from stdin
-    data = json.loads(input_textio.read())
-    raw_posts = data["posts"]
-    raw_categories = data["categories"]
+def main(input_textio, output_textio, discourse_url, lvl0, tags,
+         staging_db=None, since=None, until=None, topic_id=None,
+         category_id=None, scope_file=None, dedup=None, dedup_min_posts=10,
+         pack_bytes=None, max_html_bytes=DEFAULT_MAX_HTML_BYTES, max_parse_seconds=None,
+         max_post_records=DEFAULT_MAX_RECORDS, quarantine_report=None, priority=None,
+         compact=False):
+    deduplicator = SectionDeduplicator(int(dedup_min_posts), dedup) if dedup else None
+    pack_bytes = int(pack_bytes) if pack_bytes else None
+    max_parse_seconds = float(max_parse_seconds) if max_parse_seconds else None
+    budget = PostBudget(int(max_html_bytes), max_parse_seconds, int(max_post_records))
+    priority = PostPriority(parse_priority(priority)) if priority else None
+    scope = Scope(since, until, topic_id, category_id)
+    if scope:
+        print_to_stderr(f"Transforming {scope}")
+    if staging_db:
+        with StagingStore(staging_db) as store:
+            transformer = TransformDiscourseToAlgolia.from_staging(
+                discourse_url, store, lvl0, tags, since, topic_id, category_id,
+                until, deduplicator=deduplicator, pack_bytes=pack_bytes, budget=budget,
+                priority=priority)
+    else:
+        # Read input from stdin
+        data = json_codec.load(input_textio)
+        raw_posts = data["posts"]
+        raw_categories = data["categories"]
 
-    # Transform data
-    transformer = TransformDiscourseToAlgolia(
-        discourse_url, raw_categories, raw_posts, lvl0, tags)
+        # Transform data
+        transformer = TransformDiscourseToAlgolia(
+            discourse_url, raw_categories, raw_posts, lvl0, tags, deduplicator,
+            pack_bytes, budget, priority, scope)
     algolia_objects = transformer.algolia_objects
 
     # Pretty print to output
-    output_textio.write(json.dumps(algolia_objects, indent=4, sort_keys=True))
+    json_codec.dump(algolia_objects, output_textio, indent=None if compact else 4,
+                    sort_keys=True)
     print_to_stderr(
-        f"Transformed {len(raw_posts)} discourse posts into {len(algolia_objects)} algolia objects.")
+        f"Transformed {transformer.post_count} discourse posts into {len(algolia_objects)} algolia objects.")
+    if deduplicator is not None:
+        print_to_stderr(deduplicator.summary())
+    if budget.quarantined:
+        print_to_stderr(budget.summary())
+    if quarantine_report:
+        budget.write_report(quarantine_report)
+    if scope_file:
+        write_scope_file(scope_file, scope, transformer.scope_urls)
 
 
 # Main function
@@ -232,4 +410,11 @@ if __name__ == "__main__":
     discourse_url = arguments['--discourse-url']
     lvl0 = arguments['--lvl0']
     tags = arguments['--tag']  # list
-    main(sys.stdin, sys.stdout, discourse_url, lvl0, tags)
+    main(sys.stdin, sys.stdout, discourse_url, lvl0, tags,
+         arguments['--staging-db'], arguments['--since'], arguments['--until'],
+         arguments['--topic'], arguments['--category'], arguments['--scope-file'],
+         arguments['--dedup'], arguments['--dedup-min-posts'],
+         arguments['--pack-bytes'], arguments['--max-html-bytes'],
+         arguments['--max-parse-seconds'], arguments['--max-post-records'],
+         arguments['--quarantine-report'], arguments['--priority'],
+         arguments['--compact'])
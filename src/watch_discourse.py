@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+from algoliasearch.search_client import SearchClient
+from datetime import datetime, timezone
+from docopt import docopt
+from fluent_discourse import Discourse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+
+if __package__ in (None, ""):
+    # Run as src/watch_discourse.py, make the src package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import json_codec  # noqa: E402
+from src.extract_discourse import (extract_categories, extract_topic_posts,  # noqa: E402
+                                   with_topic_fields)
+from src.quarantine import PostBudget  # noqa: E402
+from src.record_hash import with_content_hash  # noqa: E402
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia  # noqa: E402
+
+
+def print_to_stderr(*a, **k):
+    print(*a, file=sys.stderr, **k)
+
+
+debug = False
+debug_log = print_to_stderr if debug else lambda *a, **k: None
+
+# DocOpt definition of the command line interface.
+help = """
+Keep Algolia up to date with a Discourse forum in near-real-time. Accepts
+Discourse post and topic webhooks on a local HTTP endpoint and polls the latest
+posts as a fallback for missed webhooks. Events are coalesced per topic and only
+the affected posts are transformed and upserted or deleted.
+
+Usage:
+    watch-discourse <algolia-index-name> --discourse-url=<discourse-url> --lvl0=<lvl0> --tag=<tag>... [options]
+
+Options:
+    --discourse-url=<discourse-url>  The base url of the discourse forum.
+    --lvl0=<lvl0>                    The top level category name to nest all search results under. [default: Forum]
+    --tag=<tag>                      The tags to add to all algolia objects. [default: community]
+    --host=<host>                    The address to accept webhooks on. [default: 127.0.0.1]
+    --port=<port>                    The port to accept webhooks on. [default: 8080]
+    --debounce=<seconds>             How long a topic must be quiet before it is indexed. [default: 5]
+    --max-delay=<seconds>            The longest a busy topic waits before it is indexed. [default: 30]
+    --poll-interval=<seconds>        How often to poll the latest posts, 0 to disable. [default: 60]
+    --state-file=<file>              Where to keep the objectIDs indexed for each post. [default: watch-state.json]
+    --algolia-json=<file>            Transform output to seed the state from when there is no state file. [default: algolia.json]
+
+Environment Variables:
+    DISCOURSE_URL             The URL of the Discourse instance.
+    DISCOURSE_USERNAME        The username to use for the Discourse API.
+    DISCOURSE_API_KEY         The API key to use for the Discourse API.
+    DISCOURSE_WEBHOOK_SECRET  Optional, the secret configured on the webhook.
+    ALGOLIA_APP_ID
+    ALGOLIA_API_KEY
+"""
+
+# Topic events that change what every post of the topic looks like in Algolia
+# (title, slug, category), so the whole topic is fetched again.
+TOPIC_REFETCH_EVENTS = [
+    "topic_edited",
+    "topic_recovered",
+]
+
+# A topic that fails to index is retried after RETRY_SECONDS, doubling with
+# every failure, and dropped after MAX_ATTEMPTS so a permanent error (e.g. a
+# deleted topic) doesn't fail forever.
+RETRY_SECONDS = 5
+MAX_ATTEMPTS = 5
+
+# Fields that webhook post payloads may leave out but the transform needs.
+TOPIC_FIELDS = [
+    "topic_slug",
+    "topic_title",
+    "category_id",
+    "topic_accepted_answer",
+]
+
+
+def post_key(topic_id, post_number):
+    """ identify a post the same way its algolia urls do."""
+    return f"{topic_id}/{post_number}"
+
+
+def post_key_from_url(url):
+    topic_id, post_number = url.rstrip("/").split("/")[-2:]
+    return post_key(topic_id, post_number)
+
+
+class TopicDebouncer:
+    """ collects events per topic until the topic has been quiet for `debounce`
+    seconds, or `max_delay` seconds have passed since its first event, so a
+    burst of edits in one topic is indexed once."""
+
+    def __init__(self, debounce, max_delay):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pending = {}
+        # Topics given up on after MAX_ATTEMPTS failures.
+        self.dropped = []
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _pending_topic(self, topic_id, now):
+        pending = self._pending.get(topic_id)
+        if pending is None:
+            pending = {"first": now, "posts": {}, "refetch": False,
+                       "destroyed": False, "attempts": 0, "retry_at": now}
+            self._pending[topic_id] = pending
+        pending["last"] = now
+        return pending
+
+    def add_post(self, post, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            pending = self._pending_topic(post["topic_id"], now)
+            # The latest event for a post wins.
+            pending["posts"][post["id"]] = post
+
+    def add_topic(self, topic_id, destroyed=False, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            pending = self._pending_topic(topic_id, now)
+            pending["destroyed"] = destroyed
+            pending["refetch"] = not destroyed
+            if destroyed:
+                pending["posts"] = {}
+
+    def requeue(self, topic_id, pending, now=None):
+        """ put back a topic that failed to index so it is retried with
+        backoff. Returns False when it failed MAX_ATTEMPTS times and is
+        dropped instead."""
+        now = time.monotonic() if now is None else now
+        attempts = pending["attempts"] + 1
+        with self._lock:
+            if attempts >= MAX_ATTEMPTS:
+                self.dropped.append(topic_id)
+                return False
+            current = self._pending_topic(topic_id, now)
+            current["refetch"] = current["refetch"] or pending["refetch"]
+            current["destroyed"] = current["destroyed"] or pending["destroyed"]
+            for post_id, post in pending["posts"].items():
+                current["posts"].setdefault(post_id, post)
+            current["attempts"] = attempts
+            current["retry_at"] = now + RETRY_SECONDS * 2 ** (attempts - 1)
+            return True
+
+    def pop_ready(self, now=None):
+        """ remove and return [(topic_id, pending)] for topics due to index."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            ready = [topic_id for topic_id, pending in self._pending.items()
+                     if now >= pending["retry_at"]
+                     and (now - pending["last"] >= self.debounce
+                          or now - pending["first"] >= self.max_delay)]
+            return [(topic_id, self._pending.pop(topic_id)) for topic_id in ready]
+
+
+class WatchIndexer:
+    """ re-transforms the posts of a debounced topic and applies the
+    difference to algolia. `records_by_post` maps post keys to the objectIDs
+    currently in the index for that post, so stale records can be deleted."""
+
+    def __init__(self, index, discourse_url, raw_categories, lvl0, tags,
+                 records_by_post=None, client=None):
+        self.index = index
+        self.discourse_url = discourse_url
+        self.raw_categories = raw_categories
+        self.lvl0 = lvl0
+        self.tags = tags
+        self.records_by_post = records_by_post if records_by_post is not None else {}
+        self.client = client
+        self._lock = threading.Lock()
+
+    def index_topic(self, topic_id, pending):
+        """ returns the number of records upserted and deleted."""
+        with self._lock:
+            if pending["destroyed"]:
+                posts = []
+                stale_keys = self._topic_keys(topic_id)
+            elif pending["refetch"]:
+                posts = extract_topic_posts(topic_id, self.client)
+                stale_keys = self._topic_keys(topic_id)
+            else:
+                posts = list(pending["posts"].values())
+                stale_keys = set()
+            return self._replace_posts(posts, stale_keys)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: set(ids) for key, ids in self.records_by_post.items()}
+
+    def _topic_keys(self, topic_id):
+        prefix = post_key(topic_id, "")
+        return {key for key in self.records_by_post if key.startswith(prefix)}
+
+    def _replace_posts(self, posts, stale_keys):
+        live_posts = [self._complete(post) for post in posts
+                      if not post.get("hidden") and not post.get("deleted_at")]
+        budget = PostBudget.with_default_limits()
+        transformer = TransformDiscourseToAlgolia(
+            self.discourse_url, self.raw_categories, live_posts, self.lvl0, self.tags,
+            budget=budget)
+        for quarantined in budget.quarantined:
+            print_to_stderr(f"Quarantined {quarantined['url']}: {quarantined['detail']}")
+        records_by_key = {}
+        for record in transformer.algolia_objects:
+            key = post_key_from_url(record["url"])
+            records_by_key.setdefault(key, set()).add(record["objectID"])
+
+        keys = set(stale_keys)
+        keys.update(post_key(post["topic_id"], post["post_number"])
+                    for post in posts)
+        deletes = []
+        for key in keys:
+            deletes.extend(self.records_by_post.get(key, set())
+                           - records_by_key.get(key, set()))
+
+        # Hashed like a full load so a later reconcile sees them as current.
+        upserts = with_content_hash(transformer.algolia_objects)
+        if upserts:
+            self.index.save_objects(upserts).wait()
+        if deletes:
+            self.index.delete_objects(sorted(deletes)).wait()
+        # Only once algolia has them, so a retry still knows what to delete.
+        for key in keys:
+            if key in records_by_key:
+                self.records_by_post[key] = records_by_key[key]
+            else:
+                self.records_by_post.pop(key, None)
+        return len(upserts), len(deletes)
+
+    def _complete(self, post):
+        """ fill in topic fields that a webhook payload left out."""
+        if all(field in post for field in TOPIC_FIELDS):
+            return post
+        topic = self.client.t[post["topic_id"]].json.get()
+        return with_topic_fields(post, topic)
+
+
+class LatestPostsPoller:
+    """ fallback for missed webhooks, queues posts from the first page of
+    posts.json that are new or were edited since the previous poll."""
+
+    def __init__(self, debouncer, client):
+        self.debouncer = debouncer
+        self.client = client
+        self._seen = None
+
+    def poll_once(self):
+        posts = self.client.posts.json.get()["latest_posts"]
+        seen = {post["id"]: post["updated_at"] for post in posts}
+        queued = 0
+        # The first poll only establishes what the index already has.
+        if self._seen is not None:
+            newest_seen = max(self._seen, default=0)
+            for post in posts:
+                if post["id"] in self._seen:
+                    changed = self._seen[post["id"]] != post["updated_at"]
+                else:
+                    changed = post["id"] > newest_seen
+                if changed:
+                    self.debouncer.add_post(post)
+                    queued += 1
+        self._seen = seen
+        return queued
+
+
+def handle_webhook(debouncer, event, payload):
+    """ queue a Discourse webhook payload. Returns False when the event does
+    not affect the index (e.g. ping)."""
+    if "post" in payload:
+        post = dict(payload["post"])
+        if event == "post_destroyed" and not post.get("deleted_at"):
+            post["deleted_at"] = datetime.now(timezone.utc).isoformat()
+        debouncer.add_post(post)
+        return True
+    if "topic" in payload:
+        topic_id = payload["topic"]["id"]
+        if event == "topic_destroyed":
+            debouncer.add_topic(topic_id, destroyed=True)
+            return True
+        if event in TOPIC_REFETCH_EVENTS:
+            debouncer.add_topic(topic_id)
+            return True
+    return False
+
+
+def signature_ok(secret, body, signature):
+    """ check the X-Discourse-Event-Signature header when a secret is set."""
+    if not secret:
+        return True
+    expected = "sha256=" + hmac.new(
+        secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    # Set on the server: debouncer and webhook_secret.
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not signature_ok(self.server.webhook_secret, body,
+                            self.headers.get("X-Discourse-Event-Signature")):
+            self._reply(403, {"error": "bad signature"})
+            return
+        try:
+            payload = json_codec.loads(body)
+        except ValueError:
+            self._reply(400, {"error": "invalid json"})
+            return
+        event = self.headers.get("X-Discourse-Event", "")
+        queued = handle_webhook(self.server.debouncer, event, payload)
+        self._reply(202 if queued else 200, {"queued": queued})
+
+    def do_GET(self):
+        self._reply(200, {"pending_topics": len(self.server.debouncer),
+                          "dropped_topics": self.server.debouncer.dropped})
+
+    def _reply(self, status, body):
+        data = json_codec.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        debug_log(format % args)
+
+
+def create_webhook_server(host, port, debouncer, webhook_secret=None):
+    server = ThreadingHTTPServer((host, port), WebhookHandler)
+    server.debouncer = debouncer
+    server.webhook_secret = webhook_secret
+    return server
+
+
+def index_ready_topics(debouncer, indexer, now=None):
+    """ returns True if any topic was indexed."""
+    indexed = False
+    for topic_id, pending in debouncer.pop_ready(now):
+        try:
+            upserts, deletes = indexer.index_topic(topic_id, pending)
+            print_to_stderr(
+                f"Topic {topic_id}: upserted {upserts}, deleted {deletes} objects")
+            indexed = True
+        except Exception as e:
+            print_to_stderr(f"ERROR: indexing topic {topic_id} failed: {e}")
+            if not debouncer.requeue(topic_id, pending, now):
+                print_to_stderr(f"ERROR: dropped topic {topic_id} after {MAX_ATTEMPTS} "
+                                "failed attempts, a full run or reconcile will pick it up")
+    return indexed
+
+
+def load_state(state_file, algolia_json):
+    """ returns {post key: set of objectIDs} from the state file, or from the
+    transform output if the watcher has not run before."""
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            return {key: set(ids) for key, ids in json_codec.load(f).items()}
+    records_by_post = {}
+    if os.path.exists(algolia_json):
+        with open(algolia_json) as f:
+            for record in json_codec.load(f):
+                key = post_key_from_url(record["url"])
+                records_by_post.setdefault(key, set()).add(record["objectID"])
+    return records_by_post
+
+
+def save_state(state_file, records_by_post):
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json_codec.dump({key: sorted(ids) for key, ids in records_by_post.items()}, f)
+    os.replace(tmp_file, state_file)
+
+
+def _run_every(interval, stop, action):
+    while not stop.wait(interval):
+        try:
+            action()
+        except Exception as e:
+            print_to_stderr(f"ERROR: {e}")
+
+
+def watch(arguments):
+    client = Discourse.from_env(raise_for_rate_limit=False)
+    algolia = SearchClient.create(
+        os.environ.get('ALGOLIA_APP_ID'), os.environ.get('ALGOLIA_API_KEY'))
+    index = algolia.init_index(arguments['<algolia-index-name>'])
+    state_file = arguments['--state-file']
+    indexer = WatchIndexer(
+        index, arguments['--discourse-url'], extract_categories(),
+        arguments['--lvl0'], arguments['--tag'],
+        load_state(state_file, arguments['--algolia-json']), client)
+    debouncer = TopicDebouncer(
+        float(arguments['--debounce']), float(arguments['--max-delay']))
+    server = create_webhook_server(
+        arguments['--host'], int(arguments['--port']), debouncer,
+        os.environ.get('DISCOURSE_WEBHOOK_SECRET'))
+
+    def flush():
+        if index_ready_topics(debouncer, indexer):
+            save_state(state_file, indexer.snapshot())
+
+    stop = threading.Event()
+    threads = [threading.Thread(target=_run_every, args=(0.5, stop, flush))]
+    poll_interval = float(arguments['--poll-interval'])
+    if poll_interval > 0:
+        poller = LatestPostsPoller(debouncer, client)
+        poller.poll_once()
+
+        def poll():
+            indexer.raw_categories = extract_categories()
+            poller.poll_once()
+        threads.append(threading.Thread(
+            target=_run_every, args=(poll_interval, stop, poll)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    host, port = server.server_address[:2]
+    print_to_stderr(f"Listening for Discourse webhooks on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        for thread in threads:
+            thread.join()
+        # Index whatever is still waiting before exiting.
+        index_ready_topics(debouncer, indexer, now=float("inf"))
+        save_state(state_file, indexer.snapshot())
+
+
+# Main function
+if __name__ == "__main__":
+    # Parse arguments
+    arguments = docopt(help)
+    debug_log(arguments)
+    watch(arguments)
@@ -1,5 +1,7 @@
 import json
 
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia
+
 RAW_POSTS = json.loads(r"""
   [
       {
@@ -275,6 +277,22 @@ RAW_CATEGORIES = json.loads(r'''
 ''')
 
 
+# One public category, for tests about posts rather than categories.
+CATEGORIES = [{"id": 1, "name": "Uncategorized", "read_restricted": False}]
+
+
+def transform_posts(posts, **options):
+    """ the records the transform makes from posts in CATEGORIES."""
+    return TransformDiscourseToAlgolia(
+        "http://example.com", CATEGORIES, posts, "Forum", ["community"],
+        **options).algolia_objects
+
+
+def transform_cooked(cooked, **options):
+    """ the records of the first of RAW_POSTS with its html replaced."""
+    return transform_posts([dict(RAW_POSTS[0], cooked=cooked)], **options)
+
+
 LONG_POST = json.loads(r'''
     {
       "id": 5137,
@@ -0,0 +1,247 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import random
+import re
+import threading
+import time
+
+# Discourse embeds at most this many posts in /t/{id}.json.
+TOPIC_PAGE_SIZE = 20
+
+# Discourse lists this many topics per page of /c/{id}.json.
+CATEGORY_PAGE_SIZE = 30
+
+WORDS = ["notecard", "antenna", "firmware", "battery", "modem", "gps", "sync",
+         "voltage", "route", "hub", "sensor", "cellular", "wifi", "json"]
+
+# Fields posts.json has on every post that topic endpoints leave out.
+POSTS_JSON_ONLY_FIELDS = [
+    "topic_slug",
+    "topic_title",
+    "topic_html_title",
+    "category_id",
+    "topic_accepted_answer",
+]
+
+TOPIC_PATH = re.compile(r"^/t/(\d+)\.json$")
+TOPIC_POSTS_PATH = re.compile(r"^/t/(\d+)/posts\.json$")
+CATEGORY_PATH = re.compile(r"^/c/(\d+)\.json$")
+
+
+def timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(seconds))
+
+
+def generate_corpus(topics=10, posts_per_topic=5, categories=3, seed=0):
+    """ returns (categories, topics, posts) shaped like the Discourse API, with
+    post ids counting up from 1 in the order the posts were created."""
+    rng = random.Random(seed)
+    raw_categories = [{"id": i, "name": f"Category {i}", "slug": f"category-{i}",
+                       "read_restricted": False} for i in range(1, categories + 1)]
+    raw_topics = []
+    for topic_id in range(1, topics + 1):
+        title = " ".join(rng.choice(WORDS) for _ in range(5)).capitalize()
+        raw_topics.append({
+            "id": topic_id,
+            "title": title,
+            "slug": title.lower().replace(" ", "-"),
+            "category_id": rng.randint(1, categories),
+            "accepted_answer": rng.random() < 0.3,
+            "posts_count": 0,
+        })
+    posts = []
+    created = 1672531200  # 2023-01-01
+    for _ in range(topics * posts_per_topic):
+        topic = rng.choice(raw_topics)
+        topic["posts_count"] += 1
+        created += rng.randint(60, 3600)
+        paragraphs = "".join(
+            f"<p>{' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))}</p>"
+            for _ in range(rng.randint(1, 6)))
+        posts.append({
+            "id": len(posts) + 1,
+            "topic_id": topic["id"],
+            "topic_slug": topic["slug"],
+            "topic_title": topic["title"],
+            "topic_html_title": topic["title"],
+            "category_id": topic["category_id"],
+            "post_number": topic["posts_count"],
+            "cooked": paragraphs,
+            "created_at": timestamp(created),
+            "updated_at": timestamp(created),
+            "version": 1,
+            "hidden": False,
+            "deleted_at": None,
+            "topic_accepted_answer": topic["accepted_answer"],
+            "reads": rng.randint(0, 500),
+            "score": round(rng.random() * 100, 1),
+            "username": rng.choice(WORDS),
+            "avatar_template": "/user_avatar/example.com/user/{size}/1_2.png",
+            "can_edit": True,
+            "can_delete": True,
+            "flair_name": None,
+            "actions_summary": [{"id": 2, "can_act": True}],
+        })
+    return raw_categories, raw_topics, posts
+
+
+class FakeDiscourse:
+    """ a localhost stand-in for the parts of the Discourse API the extract
+    uses, serving a generated corpus. Every request waits `latency` seconds,
+    posts.json returns `page_size` posts, the request numbers in
+    `rate_limited_requests` are answered with a 429 the first time, and
+    scheduled edits are applied between requests."""
+
+    def __init__(self, categories, topics, posts, page_size=50, latency=0,
+                 rate_limited_requests=(), rate_limit_wait_seconds=0):
+        self.categories = categories
+        self.topics = {topic["id"]: topic for topic in topics}
+        self.posts = {post["id"]: post for post in posts}
+        self.page_size = page_size
+        self.latency = latency
+        self.rate_limited_requests = set(rate_limited_requests)
+        self.rate_limit_wait_seconds = rate_limit_wait_seconds
+        self.request_log = []
+        self._edits = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDiscourseHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def schedule_edit(self, after_requests, post_id, cooked):
+        """ replace a post's cooked html once `after_requests` requests have
+        been served, bumping its version and updated_at."""
+        with self._lock:
+            self._edits.append((after_requests, post_id, cooked))
+
+    def _apply_edits(self):
+        for edit in list(self._edits):
+            after_requests, post_id, cooked = edit
+            if len(self.request_log) >= after_requests:
+                post = self.posts[post_id]
+                post["cooked"] = cooked
+                post["version"] += 1
+                post["updated_at"] = timestamp(time.time())
+                self._edits.remove(edit)
+
+    def respond(self, path, query):
+        """ returns (status, body) for a GET request."""
+        with self._lock:
+            self._apply_edits()
+            self.request_log.append(path)
+            request_number = len(self.request_log)
+            if request_number in self.rate_limited_requests:
+                return 429, {"errors": ["You've performed this action too many times."],
+                             "extras": {"wait_seconds": self.rate_limit_wait_seconds}}
+            if path == "/posts.json":
+                return 200, self._latest_posts(query)
+            if path == "/site.json":
+                return 200, {"categories": self.categories}
+            if path == "/latest.json":
+                return 200, self._latest_topics()
+            match = TOPIC_PATH.match(path)
+            if match and int(match.group(1)) in self.topics:
+                return 200, self._topic(int(match.group(1)))
+            match = TOPIC_POSTS_PATH.match(path)
+            if match and int(match.group(1)) in self.topics:
+                return 200, self._topic_posts(int(match.group(1)), query)
+            match = CATEGORY_PATH.match(path)
+            if match:
+                return 200, self._category_topics(int(match.group(1)), query)
+            return 404, {"errors": ["The requested URL or resource could not be found."]}
+
+    def _latest_posts(self, query):
+        before = int(query.get("before", ["0"])[0])
+        ids = sorted((post_id for post_id in self.posts
+                      if before == 0 or post_id < before), reverse=True)
+        return {"latest_posts": [self.posts[post_id]
+                                 for post_id in ids[:self.page_size]]}
+
+    def _last_posted(self, topic):
+        return max((post["id"] for post in self.posts.values()
+                    if post["topic_id"] == topic["id"]), default=0)
+
+    def _topic_list(self, topics):
+        topics = sorted(topics, key=self._last_posted, reverse=True)
+        return {"topic_list": {"topics": [
+            {key: topic[key] for key in ["id", "title", "slug", "category_id", "posts_count"]}
+            for topic in topics]}}
+
+    def _latest_topics(self):
+        return self._topic_list(self.topics.values())
+
+    def _category_topics(self, category_id, query):
+        page = int(query.get("page", ["0"])[0])
+        topics = self._topic_list(topic for topic in self.topics.values()
+                                  if topic["category_id"] == category_id)
+        start = page * CATEGORY_PAGE_SIZE
+        topic_list = topics["topic_list"]
+        topic_list["topics"] = topic_list["topics"][start:start + CATEGORY_PAGE_SIZE]
+        return topics
+
+    def _topic_post_ids(self, topic_id):
+        return sorted(post_id for post_id, post in self.posts.items()
+                      if post["topic_id"] == topic_id)
+
+    def _topic_post(self, post_id):
+        post = self.posts[post_id]
+        return {key: value for key, value in post.items()
+                if key not in POSTS_JSON_ONLY_FIELDS}
+
+    def _topic(self, topic_id):
+        topic = self.topics[topic_id]
+        stream = self._topic_post_ids(topic_id)
+        body = dict(topic)
+        body["accepted_answer"] = {"post_number": 2} if topic["accepted_answer"] else None
+        body["post_stream"] = {
+            "posts": [self._topic_post(post_id) for post_id in stream[:TOPIC_PAGE_SIZE]],
+            "stream": stream,
+        }
+        return body
+
+    def _topic_posts(self, topic_id, query):
+        post_ids = {int(post_id) for post_id in query.get("post_ids[]", [])}
+        stream = [post_id for post_id in self._topic_post_ids(topic_id)
+                  if post_id in post_ids]
+        return {"post_stream": {"posts": [self._topic_post(post_id) for post_id in stream]}}
+
+
+class FakeDiscourseHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlparse(self.path)
+        status, body = fake.respond(url.path, parse_qs(url.query))
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,121 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest.mock import patch
+
+from src import cli
+from .data import CATEGORIES, RAW_POSTS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def modules_imported_by(code):
+    result = subprocess.run(
+        [sys.executable, "-c",
+         code + "; import sys; print(' '.join(sorted(sys.modules)))"],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+class TestCli(unittest.TestCase):
+
+    def test_cli_does_not_import_stage_dependencies(self):
+        modules = modules_imported_by("import src.cli")
+        for heavy in ["bs4", "algoliasearch", "fluent_discourse"]:
+            self.assertNotIn(heavy, modules)
+
+    def test_transform_stage_only_imports_what_it_needs(self):
+        modules = modules_imported_by(
+            "import src.cli; src.cli.import_stage('transform')")
+        self.assertIn("bs4", modules)
+        self.assertNotIn("algoliasearch", modules)
+        self.assertNotIn("fluent_discourse", modules)
+
+    def test_transform_command_reads_and_writes_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            discourse_json = os.path.join(tmp, "discourse.json")
+            algolia_json = os.path.join(tmp, "algolia.json")
+            with open(discourse_json, "w") as f:
+                json.dump({"posts": RAW_POSTS[:1], "categories": CATEGORIES}, f)
+            cli.main(["transform", "--discourse-url=http://example.com",
+                      "--lvl0=Forum", "--tag=community",
+                      discourse_json, algolia_json])
+            with open(algolia_json) as f:
+                objects = json.load(f)
+        self.assertEqual(len(objects), 3)
+        self.assertEqual(objects[0]["hierarchy"]["lvl1"], "Uncategorized")
+
+    def test_wrapper_resolves_files_from_the_callers_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "d.json"), "w") as f:
+                json.dump({"posts": RAW_POSTS[:1], "categories": CATEGORIES}, f)
+            os.symlink(os.path.join(ROOT, "discourse-algolia-etl"),
+                       os.path.join(tmp, "etl"))
+            subprocess.run(["./etl", "transform", "--discourse-url=http://example.com",
+                            "--lvl0=Forum", "--tag=community", "d.json", "a.json"],
+                           cwd=tmp, capture_output=True, check=True)
+            self.assertTrue(os.path.exists(os.path.join(tmp, "a.json")))
+
+    def test_scoped_transform_writes_scope_file(self):
+        topic_id = RAW_POSTS[0]["topic_id"]
+        with tempfile.TemporaryDirectory() as tmp:
+            discourse_json = os.path.join(tmp, "discourse.json")
+            algolia_json = os.path.join(tmp, "algolia.json")
+            scope_json = os.path.join(tmp, "scope.json")
+            with open(discourse_json, "w") as f:
+                json.dump({"posts": RAW_POSTS, "categories": CATEGORIES}, f)
+            cli.main(["transform", "--discourse-url=http://example.com",
+                      "--lvl0=Forum", "--tag=community", f"--topic={topic_id}",
+                      f"--scope-file={scope_json}", discourse_json, algolia_json])
+            with open(algolia_json) as f:
+                objects = json.load(f)
+            with open(scope_json) as f:
+                scope = json.load(f)
+        self.assertEqual(scope["topic_id"], topic_id)
+        self.assertEqual(len(scope["post_urls"]),
+                         len([post for post in RAW_POSTS if post["topic_id"] == topic_id]))
+        for algolia_object in objects:
+            self.assertIn(f"/{topic_id}/", algolia_object["url"])
+
+    def test_scoped_run_keeps_its_own_data_files(self):
+        def data_files(**scope):
+            environ = dict(DISCOURSE_URL="http://example.com", ALGOLIA_INDEX_NAME="live", **scope)
+            with patch.dict(os.environ, environ, clear=True), \
+                    patch.object(cli, "extract") as extract, \
+                    patch.object(cli, "transform") as transform, \
+                    patch.object(cli, "load") as load:
+                cli.run(["all"])
+            self.assertEqual(transform.call_args.args[3], extract.call_args.args[0])
+            self.assertEqual(load.call_args.args[0], transform.call_args.args[4])
+            return extract.call_args.args[0], load.call_args.args[0]
+        self.assertEqual(data_files(), ("discourse.json", "algolia.json"))
+        self.assertEqual(data_files(DISCOURSE_TOPIC="1436"),
+                         ("discourse-partial.json", "algolia-partial.json"))
+        self.assertEqual(data_files(DISCOURSE_TOPIC="1436", ALGOLIA_DATA_FILE="a.json")[1],
+                         "a.json")
+
+    def test_run_writes_compact_intermediate_files(self):
+        environ = {"DISCOURSE_URL": "http://example.com", "ALGOLIA_INDEX_NAME": "live"}
+        with patch.dict(os.environ, environ, clear=True), \
+                patch.object(cli, "extract") as extract, \
+                patch.object(cli, "transform") as transform, \
+                patch.object(cli, "load"):
+            cli.run(["all"])
+        self.assertTrue(extract.call_args.kwargs["compact"])
+        self.assertTrue(transform.call_args.kwargs["compact"])
+
+    def test_stage_options_are_documented_like_the_cli(self):
+        def option_docs(help):
+            options = help.split("Options:\n", 1)[1].split("\n\n", 1)[0]
+            return {line.split()[0]: " ".join(line.split()[1:]) for line in options.splitlines()}
+        cli_docs = option_docs(cli.help)
+        for stage in cli.STAGES:
+            for option, doc in option_docs(cli.import_stage(stage).help).items():
+                self.assertEqual(doc, cli_docs[option], option)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import copy
+
+from src.dedup import SectionDeduplicator, fingerprint
+from .data import RAW_POSTS, transform_posts
+
+
+ANSWERS = ["antenna", "battery", "firmware", "gps", "modem", "voltage"]
+
+BOILERPLATE = "Thanks for reaching out! Please share your Notecard firmware version."
+
+
+def make_posts(count, extra_html=""):
+    posts = []
+    for i in range(count):
+        post = copy.deepcopy(RAW_POSTS[0])
+        post["id"] = 100 + i
+        post["post_number"] = i + 1
+        post["cooked"] = f"<p>Check the {ANSWERS[i]}</p><p>{BOILERPLATE}</p>{extra_html}"
+        posts.append(post)
+    return posts
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_ignores_case_and_whitespace(self):
+        self.assertEqual(fingerprint("Hello  World\n"), fingerprint("hello world"))
+
+    def test_near_duplicate_logs_share_fingerprint(self):
+        first = "2023-06-08 16:27:25 card.wifi error 0x1f3a id=8c1e4b2a9d"
+        second = "2023-06-09 09:01:12 card.wifi error 0x0042 id=77aa01bc33"
+        self.assertEqual(fingerprint(first), fingerprint(second))
+
+    def test_different_text_differs(self):
+        self.assertNotEqual(fingerprint("card.wifi"), fingerprint("card.voltage"))
+
+
+class TestSectionDeduplicator(unittest.TestCase):
+
+    def test_rejects_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            SectionDeduplicator(2, "sometimes")
+
+    def test_text_below_threshold_is_kept(self):
+        deduplicator = SectionDeduplicator(3, "drop")
+        deduplicator.add(1, ["repeated"])
+        deduplicator.add(2, ["repeated", "repeated"])
+        self.assertTrue(deduplicator.keep(1, "repeated"))
+
+    def test_first_mode_keeps_earliest_post(self):
+        deduplicator = SectionDeduplicator(2, "first")
+        for post_id in [5, 3, 4]:
+            deduplicator.add(post_id, [f"error {post_id}"])
+        self.assertFalse(deduplicator.keep(5, "Error 5"))
+        self.assertTrue(deduplicator.keep(3, "error 3"))
+        self.assertFalse(deduplicator.keep(4, "error 4"))
+        self.assertEqual(deduplicator.stats["suppressed"], 2)
+        self.assertEqual(deduplicator.stats["suppressed_exact"], 1)
+
+
+class TestTransformWithDedup(unittest.TestCase):
+
+    def test_drop_removes_every_copy(self):
+        objects = transform_posts(make_posts(5), deduplicator=SectionDeduplicator(5, "drop"))
+        contents = [obj["content"] for obj in objects]
+        self.assertEqual(len(objects), 5)
+        self.assertNotIn(BOILERPLATE, contents)
+
+    def test_first_keeps_copy_in_earliest_post(self):
+        deduplicator = SectionDeduplicator(5, "first")
+        objects = transform_posts(make_posts(5), deduplicator=deduplicator)
+        kept = [obj for obj in objects if obj["content"] == BOILERPLATE]
+        self.assertEqual(len(objects), 6)
+        self.assertEqual(len(kept), 1)
+        self.assertTrue(kept[0]["url"].endswith("/1"))
+        self.assertIn("suppressed 4 of 10", deduplicator.summary())
+
+    def test_kept_records_keep_their_objectIDs(self):
+        posts = make_posts(5)
+        plain = transform_posts(posts)
+        deduplicated = transform_posts(posts, deduplicator=SectionDeduplicator(5, "drop"))
+        plain_ids = {obj["objectID"] for obj in plain}
+        self.assertTrue({obj["objectID"] for obj in deduplicated} <= plain_ids)
+
+    def test_headers_are_never_suppressed(self):
+        objects = transform_posts(make_posts(5, "<h2>Details</h2>"),
+                                  deduplicator=SectionDeduplicator(2, "drop"))
+        headers = [obj for obj in objects if obj["type"] == "lvl3"]
+        self.assertEqual(len(headers), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
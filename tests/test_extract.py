@@ -0,0 +1,127 @@
+import unittest
+import math
+import os
+import tempfile
+import time
+
+from src import json_codec
+from src.extract_discourse import (POST_FIELDS, PostProjection, RateLimiter,
+                                   discourse_client, extract_categories,
+                                   extract_posts, extract_to_staging,
+                                   extract_topic_posts)
+from src.staging import StagingStore
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia
+from .fake_discourse import FakeDiscourse, generate_corpus
+
+
+class TestExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.categories, self.topics, self.posts = generate_corpus(
+            topics=3, posts_per_topic=30)
+        self.fake = FakeDiscourse(self.categories, self.topics, self.posts,
+                                  page_size=25)
+        self.fake.start()
+        self.client = discourse_client(self.fake.url, "system", "key")
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_extract_posts_pages_through_every_post(self):
+        posts = extract_posts(self.client)
+        self.assertEqual([post["id"] for post in posts],
+                         list(range(len(self.posts), 0, -1)))
+        self.assertEqual(len(self.fake.request_log),
+                         math.ceil(len(self.posts) / 25))
+
+    def test_extract_categories(self):
+        self.assertEqual(extract_categories(self.client), self.categories)
+
+    def test_extract_topic_posts_fetches_beyond_first_page(self):
+        topic = max(self.topics, key=lambda topic: topic["posts_count"])
+        self.assertGreater(topic["posts_count"], 20)
+        posts = extract_topic_posts(topic["id"], self.client)
+        self.assertEqual(len(posts), topic["posts_count"])
+        for post in posts:
+            self.assertEqual(post["topic_title"], topic["title"])
+            self.assertEqual(post["category_id"], topic["category_id"])
+            self.assertEqual(post["topic_accepted_answer"], topic["accepted_answer"])
+
+    def test_rate_limited_request_is_retried(self):
+        self.fake.rate_limited_requests = {2}
+        posts = extract_posts(self.client)
+        self.assertEqual(len(posts), len(self.posts))
+        # The rate limited page was requested twice.
+        self.assertEqual(len(self.fake.request_log),
+                         math.ceil(len(self.posts) / 25) + 1)
+
+    def test_edit_between_pages_is_picked_up(self):
+        oldest_post_id = 1
+        self.fake.schedule_edit(1, oldest_post_id, "<p>edited</p>")
+        posts = extract_posts(self.client)
+        oldest = [post for post in posts if post["id"] == oldest_post_id][0]
+        self.assertEqual(oldest["cooked"], "<p>edited</p>")
+        self.assertEqual(oldest["version"], 2)
+
+    def test_rate_limited_client_spaces_requests(self):
+        client = discourse_client(self.fake.url, "system", "key", RateLimiter(20))
+        start = time.perf_counter()
+        extract_posts(client)
+        pages = math.ceil(len(self.posts) / 25)
+        self.assertGreaterEqual(time.perf_counter() - start, (pages - 1) / 20)
+
+    def test_extract_to_staging(self):
+        count = extract_to_staging(":memory:", self.client)
+        self.assertEqual(count, len(self.posts))
+
+    def test_posts_are_projected(self):
+        projection = PostProjection()
+        posts = extract_posts(self.client, projection)
+        for post in posts:
+            self.assertEqual(set(post), set(POST_FIELDS))
+        self.assertLess(projection.kept_bytes, projection.raw_bytes)
+        self.assertIn("smaller", projection.summary())
+
+    def test_projection_measures_only_sample_pages(self):
+        projection = PostProjection(sample_pages=1)
+        pages = [self.posts[:25], self.posts[25:50]]
+        for page in pages:
+            projection(page)
+        self.assertEqual(projection.raw_bytes, len(json_codec.dumps(pages[0])))
+        self.assertIn("first 1 of 2 pages", projection.summary())
+
+    def test_full_payload_keeps_every_field(self):
+        projection = PostProjection(full_payload=True)
+        posts = extract_posts(self.client, projection)
+        self.assertIn("avatar_template", posts[0])
+        self.assertEqual(projection.summary(), "Kept full post payloads.")
+
+    def test_projection_does_not_change_transform(self):
+        def transform(posts):
+            return TransformDiscourseToAlgolia(
+                "https://discourse.example.com", self.categories, posts,
+                "Community", ["forum"]).algolia_objects
+        projected = extract_posts(self.client)
+        full = extract_posts(self.client, PostProjection(full_payload=True))
+        self.assertEqual(transform(projected), transform(full))
+
+
+class TestExtractToStagingFile(unittest.TestCase):
+
+    def test_rerun_upserts_edited_posts(self):
+        categories, topics, posts = generate_corpus(topics=3, posts_per_topic=4)
+        with FakeDiscourse(categories, topics, posts, page_size=5) as fake, \
+                tempfile.TemporaryDirectory() as tmp:
+            client = discourse_client(fake.url, "system", "key")
+            staging_db = os.path.join(tmp, "discourse.sqlite")
+            extract_to_staging(staging_db, client)
+            fake.schedule_edit(0, 3, "<p>edited</p>")
+            self.assertEqual(extract_to_staging(staging_db, client), len(posts))
+            with StagingStore(staging_db) as store:
+                post = [post for post in store.posts() if post["id"] == 3][0]
+                self.assertEqual(store.categories(), categories)
+            self.assertEqual(post["cooked"], "<p>edited</p>")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+import json
+import os
+import tempfile
+import threading
+import time
+
+from src.extract_discourse import RateLimiter
+from src.fanout import FanOut, read_config, transform_job
+from src.quarantine import DEFAULT_MAX_HTML_BYTES
+from .data import CATEGORIES, RAW_POSTS
+
+STAGE_SECONDS = 0.3
+
+# (stage, job name, start, end) of every fake extract and load, which run on
+# threads of the test process.
+STAGE_INTERVALS = []
+_intervals_lock = threading.Lock()
+
+
+def sleep_stage(stage, job):
+    start = time.monotonic()
+    time.sleep(STAGE_SECONDS)
+    with _intervals_lock:
+        STAGE_INTERVALS.append((stage, job["name"], start, time.monotonic()))
+
+
+# Stages are module level so the transform can be sent to a worker process.
+def fake_extract(job, discourse_file, rate_limiter):
+    if job["name"] == "broken":
+        raise RuntimeError("forum is down")
+    sleep_stage("extract", job)
+    with open(discourse_file, "w") as f:
+        json.dump({"posts": [1, 2, 3]}, f)
+    return 3
+
+
+def fake_transform(job, discourse_file, algolia_file):
+    with open(discourse_file) as f:
+        posts = json.load(f)["posts"]
+    with open(algolia_file, "w") as f:
+        json.dump(posts * 2, f)
+    return len(posts) * 2
+
+
+def fake_load(job, algolia_file):
+    sleep_stage("load", job)
+    with open(algolia_file) as f:
+        return len(json.load(f))
+
+
+def job(name):
+    return {"name": name, "discourse_url": f"https://{name}.example.com",
+            "algolia_index_name": name, "requests_per_second": None}
+
+
+class TestTransformJob(unittest.TestCase):
+
+    def test_oversized_post_is_quarantined(self):
+        post = dict(RAW_POSTS[0], cooked="<p>start</p><pre>" + "x" * DEFAULT_MAX_HTML_BYTES + "</pre>")
+        with tempfile.TemporaryDirectory() as tmp:
+            discourse_file = os.path.join(tmp, "discourse.json")
+            with open(discourse_file, "w") as f:
+                json.dump({"posts": [post], "categories": CATEGORIES}, f)
+            job = {"name": "forum", "discourse_url": "http://example.com",
+                   "lvl0": "Forum", "tags": ["community"]}
+            count = transform_job(job, discourse_file, os.path.join(tmp, "algolia.json"))
+        self.assertEqual(count, 1)
+
+
+class TestFanOut(unittest.TestCase):
+
+    def setUp(self):
+        STAGE_INTERVALS.clear()
+
+    def _run(self, jobs, workers):
+        with tempfile.TemporaryDirectory() as tmp:
+            fanout = FanOut(jobs, workers, tmp, fake_extract,
+                            fake_transform, fake_load)
+            return fanout.run()
+
+    def _overlapping_jobs(self, stage):
+        """ the most jobs whose `stage` ran at the same moment."""
+        intervals = [(start, end) for name, _, start, end in STAGE_INTERVALS if name == stage]
+        return max(sum(start <= moment < end for start, end in intervals)
+                   for moment, _ in intervals)
+
+    def test_jobs_run_concurrently(self):
+        jobs = [job("a"), job("b"), job("c")]
+        status = self._run(jobs, {"extract": 3, "transform": 2, "load": 3})
+        for name in ["a", "b", "c"]:
+            self.assertEqual(status[name]["state"], "done")
+            self.assertEqual(status[name]["posts"], 3)
+            self.assertEqual(status[name]["objects"], 6)
+        self.assertEqual(self._overlapping_jobs("extract"), 3)
+        self.assertGreater(self._overlapping_jobs("load"), 1)
+
+    def test_stage_pools_bound_concurrency(self):
+        jobs = [job("a"), job("b"), job("c")]
+        self._run(jobs, {"extract": 1, "transform": 1, "load": 1})
+        self.assertEqual(self._overlapping_jobs("extract"), 1)
+        self.assertEqual(self._overlapping_jobs("load"), 1)
+
+    def test_failed_job_does_not_stop_others(self):
+        status = self._run([job("broken"), job("ok")],
+                           {"extract": 1, "transform": 1, "load": 1})
+        self.assertEqual(status["broken"]["state"], "failed")
+        self.assertIn("forum is down", status["broken"]["error"])
+        self.assertEqual(status["ok"]["state"], "done")
+
+
+class TestReadConfig(unittest.TestCase):
+
+    def _read(self, config):
+        with tempfile.TemporaryDirectory() as tmp:
+            config_file = os.path.join(tmp, "config.json")
+            with open(config_file, "w") as f:
+                json.dump(config, f)
+            return read_config(config_file)
+
+    def test_fills_in_defaults(self):
+        jobs, workers = self._read(
+            {"workers": {"load": 1}, "jobs": [job("a")]})
+        self.assertEqual(jobs[0]["lvl0"], "Forum")
+        self.assertEqual(jobs[0]["tags"], ["community"])
+        self.assertEqual(workers["load"], 1)
+        self.assertEqual(workers["extract"], 4)
+
+    def test_rejects_job_without_index(self):
+        with self.assertRaises(ValueError):
+            self._read({"jobs": [{"name": "a", "discourse_url": "x"}]})
+
+    def test_rejects_duplicate_names(self):
+        with self.assertRaises(ValueError):
+            self._read({"jobs": [job("a"), job("a")]})
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_spaces_out_requests(self):
+        limiter = RateLimiter(requests_per_second=20)
+        start = time.perf_counter()
+        for _ in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.perf_counter() - start, 4 / 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
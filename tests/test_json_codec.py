@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+import io
+import json
+
+from src import json_codec
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia
+from .data import CATEGORIES, RAW_POSTS
+
+DATA = {"posts": [{"id": 1, "cooked": "<p>Café ☃</p>", "hidden": False,
+                   "deleted_at": None, "score": 1.5}],
+        "categories": CATEGORIES}
+
+
+class TestJsonCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        for indent in [None, 2, 4]:
+            self.assertEqual(json_codec.loads(json_codec.dumps(DATA, indent)), DATA)
+
+    def test_round_trip_without_orjson(self):
+        with patch.object(json_codec, "orjson", None):
+            for indent in [None, 2, 4]:
+                self.assertEqual(json_codec.loads(json_codec.dumps(DATA, indent)), DATA)
+
+    def test_compact_has_no_whitespace_between_tokens(self):
+        for orjson in [json_codec.orjson, None]:
+            with patch.object(json_codec, "orjson", orjson):
+                self.assertNotIn(", ", json_codec.dumps({"a": [1, 2]}))
+                self.assertNotIn(": ", json_codec.dumps({"a": [1, 2]}))
+
+    def test_sort_keys(self):
+        self.assertEqual(json_codec.dumps({"b": 1, "a": 2}, sort_keys=True), '{"a":2,"b":1}')
+
+    def test_int_keys_are_written_as_strings(self):
+        self.assertEqual(json_codec.loads(json_codec.dumps({1: "a"})), {"1": "a"})
+
+    def test_canonical_is_the_stdlib_encoding(self):
+        self.assertEqual(json_codec.canonical(DATA), json.dumps(DATA))
+        self.assertEqual(json_codec.canonical(DATA, sort_keys=True),
+                         json.dumps(DATA, sort_keys=True))
+
+    def test_object_ids_do_not_depend_on_the_codec(self):
+        def object_ids():
+            transformer = TransformDiscourseToAlgolia(
+                "http://example.com", CATEGORIES, RAW_POSTS[:1], "Forum", ["community"])
+            return [obj["objectID"] for obj in transformer.algolia_objects]
+        with patch.object(json_codec, "orjson", None):
+            expected = object_ids()
+        self.assertEqual(object_ids(), expected)
+
+    def test_dump_writes_to_textio(self):
+        output = io.StringIO()
+        json_codec.dump([1, 2], output)
+        self.assertEqual(output.getvalue(), "[1,2]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,283 @@
+import unittest
+import copy
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from src.load_algolia import (REBUILD_BATCH_SIZE, ensure_scope_facets,
+                              hits_of_forums, plan_reconcile, rebuild_index,
+                              reconcile, upload_in_order)
+from src.record_hash import CONTENT_HASH_ATTRIBUTE, content_hash, with_content_hash
+from src.scope import Scope, write_scope_file
+
+
+def record(object_id, content):
+    return {"objectID": object_id, "content": content, "type": "content"}
+
+
+class TestContentHash(unittest.TestCase):
+
+    def test_ignores_key_order_and_existing_hash(self):
+        first = record("a", "text")
+        second = {"type": "content", "content": "text", "objectID": "a",
+                  CONTENT_HASH_ATTRIBUTE: "stale"}
+        self.assertEqual(content_hash(first), content_hash(second))
+
+    def test_changes_with_content(self):
+        self.assertNotEqual(content_hash(record("a", "one")),
+                            content_hash(record("a", "two")))
+
+
+class TestPlanReconcile(unittest.TestCase):
+
+    def setUp(self):
+        self.local = with_content_hash(
+            [record("same", "x"), record("changed", "new"), record("new", "y")])
+        remote = with_content_hash(
+            [record("same", "x"), record("changed", "old"), record("gone", "z")])
+        # The index only returns objectID and content hash.
+        self.remote_hits = [
+            {key: hit[key] for key in ["objectID", CONTENT_HASH_ATTRIBUTE]}
+            for hit in remote]
+
+    def test_upserts_changed_and_new_and_deletes_gone(self):
+        upserts, deletes = plan_reconcile(self.local, iter(self.remote_hits))
+        self.assertEqual(sorted(obj["objectID"] for obj in upserts),
+                         ["changed", "new"])
+        self.assertEqual(deletes, ["gone"])
+
+    def test_in_sync_index_needs_nothing(self):
+        remote_hits = [
+            {"objectID": obj["objectID"],
+             CONTENT_HASH_ATTRIBUTE: obj[CONTENT_HASH_ATTRIBUTE]}
+            for obj in copy.deepcopy(self.local)]
+        self.assertEqual(plan_reconcile(self.local, remote_hits), ([], []))
+
+    def test_other_sources_are_never_deleted(self):
+        local = [dict(record("post", "x"), url="https://forum.example.com/t/a/1/1")]
+        remote_hits = [
+            {"objectID": "gone", "url": "https://forum.example.com/t/a/1/2"},
+            {"objectID": "docs", "url": "https://docs.example.com/guide"},
+            {"objectID": "other-forum", "url": "https://other.example.com/t/b/2/1"},
+        ]
+        _, deletes = plan_reconcile(local, hits_of_forums(remote_hits, local))
+        self.assertEqual(deletes, ["gone"])
+
+    def test_records_without_hash_are_upserted(self):
+        remote_hits = [{"objectID": "same"}]
+        upserts, deletes = plan_reconcile(self.local[:1], remote_hits)
+        self.assertEqual([obj["objectID"] for obj in upserts], ["same"])
+        self.assertEqual(deletes, [])
+
+
+class FakeResponse:
+
+    def __init__(self, index, objects):
+        self.index = index
+        self.objects = objects
+
+    def wait(self):
+        self.index.searchable.extend(self.objects)
+        return self
+
+
+class FakeIndex:
+    """ records each save_objects call, objects become searchable on wait()."""
+
+    def __init__(self, client=None, name=None):
+        self.client = client
+        self.name = name
+        self.saves = []
+        self.searchable = []
+        self.settings = None
+        # The attributeForDistinct setting, search groups hits by it.
+        self.distinct_attribute = None
+
+    def save_objects(self, objects):
+        # Everything saved earlier must already be searchable.
+        self.saves.append((list(objects), len(self.searchable)))
+        if self.client is not None:
+            self.client.indices[self.name] = self
+        return FakeResponse(self, objects)
+
+    def search(self, query, request_options):
+        key = "objectID"
+        if self.distinct_attribute and request_options.get("distinct", True):
+            key = self.distinct_attribute
+        count = len({algolia_object[key] for algolia_object in self.searchable})
+        return {"hits": [], "nbHits": count - self.client.lost_objects}
+
+    def delete(self):
+        self.client.indices.pop(self.name, None)
+        return FakeResponse(self, [])
+
+
+class FakeClient:
+    """ the index operations of SearchClient, over FakeIndex objects."""
+
+    def __init__(self, indices=()):
+        # The indices that exist, and every handle given out by init_index().
+        self.indices = {}
+        self.handles = {}
+        for name in indices:
+            self.indices[name] = self.init_index(name)
+        # How many objects search() undercounts by.
+        self.lost_objects = 0
+
+    def init_index(self, name):
+        return self.handles.setdefault(name, FakeIndex(self, name))
+
+    def list_indices(self):
+        return {"items": [{"name": name} for name in self.indices]}
+
+    def copy_index(self, source, destination, request_options):
+        index = self.init_index(destination)
+        index.settings = (source, request_options["scope"])
+        index.distinct_attribute = self.indices[source].distinct_attribute
+        self.indices[destination] = index
+        return FakeResponse(index, [])
+
+    def move_index(self, source, destination):
+        index = self.indices.pop(source)
+        index.name = destination
+        self.indices[destination] = index
+        return FakeResponse(index, [])
+
+
+class TestUploadInOrder(unittest.TestCase):
+
+    def test_top_records_are_searchable_before_the_rest_are_sent(self):
+        objects = [record(str(i), "x") for i in range(250)]
+        index = FakeIndex()
+        top_seconds, seconds = upload_in_order(index, objects, 2)
+        self.assertEqual([(len(saved), searchable) for saved, searchable in index.saves],
+                         [(5, 0), (245, 5)])
+        self.assertEqual(index.searchable, objects)
+        self.assertLessEqual(top_seconds, seconds)
+
+    def test_top_is_at_least_one_record(self):
+        index = FakeIndex()
+        upload_in_order(index, [record("a", "x")], 0.1)
+        self.assertEqual(len(index.saves), 1)
+
+
+class TestRebuildIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.objects = [record(str(i), "x") for i in range(2500)]
+
+    def test_duplicate_object_ids_count_once(self):
+        client = FakeClient(["live"])
+        self.objects.append(record("1", "duplicate"))
+        self.assertEqual(rebuild_index(client, "live", self.objects), 2500)
+
+    def test_replaces_live_index_through_temporary_one(self):
+        client = FakeClient(["live"])
+        old = client.indices["live"]
+        self.assertEqual(rebuild_index(client, "live", self.objects, workers=4), 2500)
+        self.assertEqual(list(client.indices), ["live"])
+        live = client.indices["live"]
+        self.assertIsNot(live, old)
+        self.assertEqual(live.settings, ("live", ["settings", "synonyms", "rules"]))
+        self.assertEqual(len(live.saves), 3)
+        self.assertTrue(all(len(saved) <= REBUILD_BATCH_SIZE for saved, _ in live.saves))
+        self.assertCountEqual(live.searchable, self.objects)
+
+    def test_counts_every_record_of_an_index_grouped_by_url(self):
+        client = FakeClient(["live"])
+        client.indices["live"].distinct_attribute = "url"
+        for i, algolia_object in enumerate(self.objects):
+            algolia_object["url"] = f"http://example.com/t/topic/1/{i // 5}"
+        self.assertEqual(rebuild_index(client, "live", self.objects), 2500)
+        self.assertEqual(client.indices["live"].distinct_attribute, "url")
+
+    def test_new_index_has_nothing_to_copy(self):
+        client = FakeClient()
+        rebuild_index(client, "live", self.objects)
+        self.assertIsNone(client.indices["live"].settings)
+
+    def test_deletes_leftover_temporary_indices(self):
+        client = FakeClient(["live", "live_tmp_1", "live_tmp_2", "other_tmp_1"])
+        rebuild_index(client, "live", self.objects)
+        self.assertEqual(sorted(client.indices), ["live", "other_tmp_1"])
+
+    def test_keeps_running_rebuilds_and_other_indices(self):
+        running = f"live_tmp_{int(time.time()) - 60}"
+        client = FakeClient(["live", running, "live_tmp_backup"])
+        rebuild_index(client, "live", self.objects)
+        self.assertEqual(sorted(client.indices), sorted(["live", "live_tmp_backup", running]))
+
+    def test_count_mismatch_leaves_live_index_alone(self):
+        client = FakeClient(["live"])
+        old = client.indices["live"]
+        client.lost_objects = 1
+        with self.assertRaises(RuntimeError):
+            rebuild_index(client, "live", self.objects)
+        self.assertEqual(list(client.indices), ["live"])
+        self.assertIs(client.indices["live"], old)
+
+    def test_refuses_empty_file(self):
+        with self.assertRaises(ValueError):
+            rebuild_index(FakeClient(["live"]), "live", [])
+
+
+class FakeSettingsIndex:
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.browsed = []
+
+    def get_settings(self):
+        return self.settings
+
+    def set_settings(self, settings):
+        self.settings = dict(self.settings, **settings)
+        return FakeResponse(FakeIndex(), [])
+
+    def browse_objects(self, params):
+        self.browsed.append(params)
+        return iter([])
+
+
+class TestEnsureScopeFacets(unittest.TestCase):
+
+    def test_adds_missing_facets_and_keeps_the_rest(self):
+        index = FakeSettingsIndex({"attributesForFaceting": ["type", "searchable(category_id)"]})
+        self.assertEqual(ensure_scope_facets(index), ["topic_id"])
+        self.assertEqual(index.settings["attributesForFaceting"],
+                         ["type", "searchable(category_id)", "filterOnly(topic_id)"])
+
+    def test_index_without_facets(self):
+        index = FakeSettingsIndex({})
+        self.assertEqual(ensure_scope_facets(index), ["topic_id", "category_id"])
+        self.assertEqual(ensure_scope_facets(index), [])
+
+    def _reconcile_topic(self, index):
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("src.load_algolia.SearchClient") as search_client:
+            search_client.create.return_value.init_index.return_value = index
+            json_file = os.path.join(tmp, "algolia.json")
+            scope_file = os.path.join(tmp, "scope.json")
+            with open(json_file, "w") as f:
+                json.dump([], f)
+            write_scope_file(scope_file, Scope(topic_id=1436), [])
+            return reconcile("live", "app", "key", json_file, scope_file=scope_file)
+
+    def test_scoped_reconcile_leaves_settings_alone(self):
+        index = FakeSettingsIndex({"attributesForFaceting": ["type"]})
+        with self.assertRaisesRegex(RuntimeError, "--setup-scope-facets live"):
+            self._reconcile_topic(index)
+        self.assertEqual(index.settings, {"attributesForFaceting": ["type"]})
+        self.assertEqual(index.browsed, [])
+
+    def test_scoped_reconcile_filters_once_set_up(self):
+        index = FakeSettingsIndex({})
+        ensure_scope_facets(index)
+        self.assertEqual(self._reconcile_topic(index), (0, 0))
+        self.assertEqual(index.browsed[0]["filters"], "topic_id:1436")
+
+
+if __name__ == "__main__":
+    unittest.main()
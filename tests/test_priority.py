@@ -0,0 +1,71 @@
+import unittest
+
+from src.priority import PostPriority, parse_priority, parse_timestamp
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia
+from .data import CATEGORIES
+from .fake_discourse import generate_corpus
+
+
+def post(post_id, updated_at="2023-06-01T00:00:00.000Z", accepted=False,
+         reads=0, score=0):
+    return {"id": post_id, "updated_at": updated_at,
+            "topic_accepted_answer": accepted, "reads": reads, "score": score}
+
+
+class TestParsePriority(unittest.TestCase):
+
+    def test_weights_default_to_one(self):
+        self.assertEqual(parse_priority("recency=2,accepted"),
+                         {"recency": 2.0, "accepted": 1.0})
+
+    def test_unknown_factor(self):
+        with self.assertRaises(ValueError):
+            parse_priority("recency,likes")
+
+
+class TestPostPriority(unittest.TestCase):
+
+    def ids(self, spec, posts):
+        return [post["id"] for post in PostPriority(parse_priority(spec)).order(posts)]
+
+    def test_recency(self):
+        posts = [post(1, "2023-01-01T00:00:00.000Z"),
+                 post(2, "2023-06-01T00:00:00.000Z"),
+                 post(3, "2023-03-01T00:00:00.000Z")]
+        self.assertEqual(self.ids("recency", posts), [2, 3, 1])
+
+    def test_recency_halves_every_30_days(self):
+        newest = parse_timestamp("2023-01-31T00:00:00.000Z")
+        older = post(1, "2023-01-01T00:00:00.000Z")
+        self.assertAlmostEqual(PostPriority({"recency": 1.0}).score(older, newest), 0.5)
+
+    def test_accepted_answers_first_and_ties_keep_order(self):
+        posts = [post(1), post(2, accepted=True), post(3), post(4, accepted=True)]
+        self.assertEqual(self.ids("accepted", posts), [2, 4, 1, 3])
+
+    def test_weights(self):
+        posts = [post(1, accepted=True), post(2, reads=10000)]
+        self.assertEqual(self.ids("accepted=1,reads=2", posts), [2, 1])
+        self.assertEqual(self.ids("accepted=2,reads=1", posts), [1, 2])
+
+    def test_missing_fields_score_zero(self):
+        posts = [{"id": 1}, post(2, score=5)]
+        self.assertEqual(self.ids("recency,score", posts), [2, 1])
+
+    def test_transform_outputs_records_in_priority_order(self):
+        _, _, posts = generate_corpus(topics=5, posts_per_topic=4, categories=1)
+        priority = PostPriority(parse_priority("reads"))
+        transformer = TransformDiscourseToAlgolia(
+            "http://example.com", CATEGORIES, posts, "Forum", ["community"],
+            priority=priority)
+        urls = []
+        for algolia_object in transformer.algolia_objects:
+            if algolia_object["url"] not in urls:
+                urls.append(algolia_object["url"])
+        expected = [transformer.post_url(post, "http://example.com")
+                    for post in sorted(posts, key=lambda post: -post["reads"])]
+        self.assertEqual(urls, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
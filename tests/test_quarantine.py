@@ -0,0 +1,89 @@
+import unittest
+import json
+import os
+import io
+import tempfile
+from unittest.mock import patch
+
+from src.quarantine import FALLBACK_TEXT_BYTES, PostBudget
+from src import transform_discourse_to_algolia
+from .data import CATEGORIES, RAW_POSTS, transform_cooked
+
+
+class TestPostBudget(unittest.TestCase):
+
+    def test_fallback_strips_tags_and_truncates(self):
+        budget = PostBudget()
+        html = "<p>log &amp; more</p>" + "<pre>" + "x" * 100000 + "</pre>"
+        sections = budget.fallback_sections(html)
+        self.assertEqual(len(sections), 1)
+        self.assertEqual(sections[0]["element"], "p")
+        self.assertTrue(sections[0]["text"].startswith("log & more x"))
+        self.assertLessEqual(len(sections[0]["text"]), FALLBACK_TEXT_BYTES)
+
+    def test_limit_records_truncates_and_quarantines(self):
+        budget = PostBudget(max_records=2)
+        sections = [(0, "a" * 400, "p"), (1, "b" * 1000, "p"), (2, "c", "p")]
+        limited = budget.limit_records("http://example.com/t/x/1/1", sections, 1000)
+        self.assertEqual([position for position, _, _ in limited], [0, 1])
+        self.assertEqual(len(limited[1][1]), 500)
+        self.assertEqual(budget.quarantined[0]["reason"], "records")
+
+    def test_limit_records_leaves_small_posts_alone(self):
+        budget = PostBudget(max_records=3)
+        sections = [(0, "a", "p"), (1, "b", "p")]
+        self.assertEqual(budget.limit_records("url", sections, 1000), sections)
+        self.assertEqual(budget.quarantined, [])
+
+    def test_main_has_no_parse_time_limit_unless_asked(self):
+        data = json.dumps({"posts": RAW_POSTS[:1], "categories": CATEGORIES})
+        with patch.object(transform_discourse_to_algolia, "PostBudget",
+                          wraps=PostBudget) as budget:
+            transform_discourse_to_algolia.main(
+                io.StringIO(data), io.StringIO(), "http://example.com", "Forum", ["community"])
+            transform_discourse_to_algolia.main(
+                io.StringIO(data), io.StringIO(), "http://example.com", "Forum", ["community"],
+                max_parse_seconds="2")
+        self.assertEqual([call.args[1] for call in budget.call_args_list], [None, 2.0])
+
+    def test_write_report(self):
+        budget = PostBudget()
+        budget.quarantine("http://example.com/t/x/1/1", "html_bytes", "big")
+        with tempfile.TemporaryDirectory() as tmp:
+            report_file = os.path.join(tmp, "quarantine.json")
+            budget.write_report(report_file)
+            with open(report_file) as f:
+                self.assertEqual(json.load(f), budget.quarantined)
+
+
+class TestTransformWithBudget(unittest.TestCase):
+
+    def test_oversized_post_takes_fallback(self):
+        budget = PostBudget(max_html_bytes=1000)
+        objects = transform_cooked("<p>start</p><pre>" + "x" * 5000 + "</pre>", budget=budget)
+        self.assertEqual(len(objects), 1)
+        self.assertEqual(budget.quarantined[0]["reason"], "html_bytes")
+        self.assertEqual(budget.quarantined[0]["url"],
+                         "http://example.com/t/ftdi-debugging-with-notecarrier-b-v2/1436/4")
+
+    def test_slow_parse_takes_fallback(self):
+        budget = PostBudget(max_parse_seconds=0)
+        objects = transform_cooked("<p>one</p><p>two</p>", budget=budget)
+        self.assertEqual([obj["content"] for obj in objects], ["one two"])
+        self.assertEqual(budget.quarantined[0]["reason"], "parse_seconds")
+
+    def test_deeply_nested_html_takes_fallback(self):
+        budget = PostBudget()
+        objects = transform_cooked("<div>" * 5000 + "deep" + "</div>" * 5000, budget=budget)
+        self.assertEqual([obj["content"] for obj in objects], ["deep"])
+
+    def test_post_within_budget_is_unchanged(self):
+        cooked = "<h1>Header</h1><p>Content</p>"
+        budget = PostBudget(1000, 10, 10)
+        self.assertEqual(transform_cooked(cooked, budget=budget),
+                         transform_cooked(cooked, budget=None))
+        self.assertEqual(budget.quarantined, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
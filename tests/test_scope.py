@@ -0,0 +1,157 @@
+import unittest
+import os
+import tempfile
+
+from src.extract_discourse import discourse_client, extract_scope_pages
+from src.load_algolia import hits_in_scope, plan_reconcile
+from src.record_hash import with_content_hash
+from src.scope import (Scope, normalize_time, read_scope_file, topic_id_from_url,
+                       write_scope_file)
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia
+from .fake_discourse import generate_corpus, FakeDiscourse
+
+URL = "http://example.com"
+
+
+def post(topic_id=1, category_id=1, updated_at="2023-06-01T12:00:00.000Z"):
+    return {"topic_id": topic_id, "category_id": category_id, "updated_at": updated_at}
+
+
+class TestScope(unittest.TestCase):
+
+    def test_empty_scope_contains_everything(self):
+        self.assertFalse(Scope())
+        self.assertTrue(Scope().contains(post()))
+        self.assertTrue(Scope().contains_record(f"{URL}/t/a/1/1", set()))
+
+    def test_time_window(self):
+        scope = Scope(since="2023-06-01", until="2023-06-02")
+        self.assertTrue(scope.contains(post(updated_at="2023-06-01T12:00:00.000Z")))
+        self.assertFalse(scope.contains(post(updated_at="2023-05-31T12:00:00.000Z")))
+        self.assertFalse(scope.contains(post(updated_at="2023-06-02T00:00:00.000Z")))
+
+    def test_time_window_compares_times_not_text(self):
+        self.assertTrue(Scope(since="2023-06-01T12:00:00Z").contains(
+            post(updated_at="2023-06-01T12:00:00.500Z")))
+        self.assertTrue(Scope(since="2023-06-01T14:00:00+02:00").contains(
+            post(updated_at="2023-06-01T12:30:00.000Z")))
+        self.assertFalse(Scope(until="2023-06-01T14:00:00+02:00").contains(
+            post(updated_at="2023-06-01T12:30:00.000Z")))
+
+    def test_normalize_time(self):
+        self.assertEqual(normalize_time("2023-06-01"), "2023-06-01T00:00:00.000Z")
+        self.assertEqual(normalize_time("2023-06-01T14:00:00+02:00"), "2023-06-01T12:00:00.000Z")
+        # Rounded up, so a post at .500Z is before since=.500100Z.
+        self.assertEqual(normalize_time("2023-06-01T12:00:00.500100Z"), "2023-06-01T12:00:00.501Z")
+
+    def test_topic_and_category(self):
+        self.assertTrue(Scope(topic_id="1").contains(post(topic_id=1)))
+        self.assertFalse(Scope(topic_id=1).contains(post(topic_id=2)))
+        self.assertFalse(Scope(category_id=2).contains(post(category_id=1)))
+
+    def test_topic_scope_covers_records_of_deleted_posts(self):
+        self.assertTrue(Scope(topic_id=7).contains_record(f"{URL}/t/old-slug/7/3", set()))
+        self.assertFalse(Scope(topic_id=7).contains_record(f"{URL}/t/a/17/3", set()))
+        # With a time window only the posts the transform saw are covered.
+        scope = Scope(topic_id=7, since="2023-06-01")
+        self.assertFalse(scope.contains_record(f"{URL}/t/a/7/3", set()))
+        self.assertTrue(scope.contains_record(f"{URL}/t/a/7/3", {f"{URL}/t/a/7/3"}))
+
+    def test_record_filters(self):
+        self.assertIsNone(Scope(since="2023-06-01").record_filters())
+        self.assertEqual(Scope(topic_id=7).record_filters(), "topic_id:7")
+        self.assertEqual(Scope(topic_id=7, category_id=3, since="2023-06-01").record_filters(),
+                         "topic_id:7 AND category_id:3")
+
+    def test_topic_id_from_url(self):
+        self.assertEqual(topic_id_from_url(f"{URL}/t/some-topic/1436/4"), 1436)
+        self.assertIsNone(topic_id_from_url(None))
+
+    def test_scope_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            scope_file = os.path.join(tmp, "scope.json")
+            write_scope_file(scope_file, Scope(since="2023-06-01", category_id=3), ["a", "b"])
+            scope, post_urls = read_scope_file(scope_file)
+        self.assertEqual(scope.to_dict(), Scope(since="2023-06-01", category_id=3).to_dict())
+        self.assertEqual(post_urls, {"a", "b"})
+
+
+class TestScopedRun(unittest.TestCase):
+
+    def setUp(self):
+        self.categories, self.topics, self.posts = generate_corpus(
+            topics=6, posts_per_topic=10, categories=2)
+        self.fake = FakeDiscourse(self.categories, self.topics, self.posts, page_size=10)
+        self.fake.start()
+        self.client = discourse_client(self.fake.url, "system", "key")
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def extract(self, scope):
+        return [post for page in extract_scope_pages(scope, self.client) for post in page]
+
+    def transform(self, posts, scope=None):
+        return TransformDiscourseToAlgolia(
+            URL, self.categories, posts, "Forum", ["community"], scope=scope)
+
+    def test_extract_topic_only_fetches_the_topic(self):
+        topic_id = self.topics[0]["id"]
+        posts = self.extract(Scope(topic_id=topic_id))
+        self.assertEqual(sorted(post["id"] for post in posts),
+                         [post["id"] for post in self.posts if post["topic_id"] == topic_id])
+        self.assertTrue(all(path.startswith(f"/t/{topic_id}") for path in self.fake.request_log))
+
+    def test_extract_category_fetches_its_topics(self):
+        posts = self.extract(Scope(category_id=2))
+        self.assertEqual(sorted(post["id"] for post in posts),
+                         [post["id"] for post in self.posts if post["category_id"] == 2])
+        self.assertNotIn("/posts.json", self.fake.request_log)
+
+    def test_extract_since_stops_paging(self):
+        since = self.posts[-15]["created_at"]
+        posts = self.extract(Scope(since=since))
+        self.assertEqual([post["id"] for post in posts],
+                         [post["id"] for post in reversed(self.posts)
+                          if post["updated_at"] >= since])
+        self.assertEqual(len(self.fake.request_log), 2)
+
+    def test_records_hold_their_topic_and_category(self):
+        post = self.posts[0]
+        for record in self.transform([post]).algolia_objects:
+            self.assertEqual((record["topic_id"], record["category_id"]),
+                             (post["topic_id"], post["category_id"]))
+
+    def test_transform_filters_and_records_scope_urls(self):
+        topic_id = self.topics[0]["id"]
+        scoped = self.transform(self.posts, Scope(topic_id=topic_id))
+        in_topic = [post for post in self.posts if post["topic_id"] == topic_id]
+        self.assertEqual(scoped.algolia_objects, self.transform(in_topic).algolia_objects)
+        self.assertEqual(scoped.post_count, len(in_topic))
+        self.assertEqual(len(scoped.scope_urls), len(in_topic))
+
+    def test_scoped_reconcile_only_touches_the_scope(self):
+        topic_id = self.topics[0]["id"]
+        index = with_content_hash(self.transform(self.posts).algolia_objects)
+        # The first post of the topic is deleted, and its second is edited.
+        in_topic = [post for post in self.posts if post["topic_id"] == topic_id]
+        deleted, edited = in_topic[0], dict(in_topic[1], cooked="<p>edited</p>")
+        posts = [edited if post is in_topic[1] else post
+                 for post in self.posts if post is not deleted]
+        scope = Scope(topic_id=topic_id)
+        scoped = self.transform(posts, scope)
+        objects = with_content_hash(scoped.algolia_objects)
+        upserts, deletes = plan_reconcile(
+            objects, hits_in_scope(index, scope, set(scoped.scope_urls)))
+        deleted_url = scoped.post_url(deleted, URL)
+        edited_url = scoped.post_url(edited, URL)
+        self.assertEqual({obj["url"] for obj in upserts}, {edited_url})
+        for hit in index:
+            if hit["url"] == deleted_url:
+                self.assertIn(hit["objectID"], deletes)
+            elif hit["objectID"] in deletes:
+                self.assertEqual(hit["url"], edited_url)
+
+
+if __name__ == "__main__":
+    unittest.main()
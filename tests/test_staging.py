@@ -0,0 +1,83 @@
+import unittest
+import copy
+
+from src.staging import StagingStore
+from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia
+from .data import CATEGORIES, RAW_POSTS
+
+
+class TestStagingStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = StagingStore(":memory:")
+        self.posts = copy.deepcopy(RAW_POSTS)
+        self.store.upsert_posts(self.posts)
+        self.store.upsert_categories(CATEGORIES)
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_upsert_replaces_post_by_id(self):
+        edited = dict(self.posts[0], cooked="<p>edited</p>", version=2)
+        self.store.upsert_posts([edited])
+        self.assertEqual(self.store.count_posts(), len(self.posts))
+        stored = [post for post in self.store.posts()
+                  if post["id"] == edited["id"]]
+        self.assertEqual(stored, [edited])
+
+    def test_posts_are_newest_first(self):
+        ids = [post["id"] for post in self.store.posts()]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_posts_changed_since(self):
+        since = "2023-06-08T16:00:00.000Z"
+        expected = [post["id"] for post in self.posts
+                    if post["updated_at"] >= since]
+        result = [post["id"] for post in self.store.posts(since=since)]
+        self.assertEqual(sorted(result), sorted(expected))
+
+    def test_posts_changed_in_window(self):
+        since, until = "2023-06-08T15:00:00.000Z", "2023-06-08T16:00:00.000Z"
+        expected = [post["id"] for post in self.posts
+                    if since <= post["updated_at"] < until]
+        result = [post["id"] for post in self.store.posts(since=since, until=until)]
+        self.assertEqual(sorted(result), sorted(expected))
+
+    def test_window_accepts_any_iso_8601_time(self):
+        # Only the post updated at 16:27:25.302Z.
+        for since in ["2023-06-08T16:27:25.302Z", "2023-06-08T18:27:25+02:00",
+                      "2023-06-08T16:27:25Z"]:
+            result = [post["updated_at"] for post in self.store.posts(since=since)]
+            self.assertEqual(result, ["2023-06-08T16:27:25.302Z"], since)
+        result = list(self.store.posts(until="2023-06-08T16:54:23.695+02:00"))
+        self.assertEqual([post["updated_at"] for post in result], ["2023-06-08T14:54:23.694Z"])
+
+    def test_posts_in_topic(self):
+        topic_id = self.posts[0]["topic_id"]
+        result = list(self.store.posts(topic_id=topic_id))
+        self.assertTrue(result)
+        for post in result:
+            self.assertEqual(post["topic_id"], topic_id)
+
+    def test_posts_in_category(self):
+        self.assertEqual(list(self.store.posts(category_id=999)), [])
+        self.assertEqual(len(list(self.store.posts(category_id=1))),
+                         len([p for p in self.posts if p["category_id"] == 1]))
+
+    def test_categories(self):
+        self.assertEqual(self.store.categories(), CATEGORIES)
+
+    def test_transform_from_staging(self):
+        topic_id = self.posts[0]["topic_id"]
+        transformer = TransformDiscourseToAlgolia.from_staging(
+            "http://example.com", self.store, "Forum", ["community"],
+            topic_id=topic_id)
+        expected = TransformDiscourseToAlgolia(
+            "http://example.com", CATEGORIES,
+            list(self.store.posts(topic_id=topic_id)), "Forum", ["community"])
+        self.assertEqual(transformer.algolia_objects, expected.algolia_objects)
+        self.assertEqual(transformer.post_count, expected.post_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,8 +3,9 @@ import json
 from unittest.mock import patch
 from hashlib import sha1
 
-from src.transform_discourse_to_algolia import TransformDiscourseToAlgolia
-from .data import LONG_POST, RAW_CATEGORIES, RAW_POSTS
+from src.transform_discourse_to_algolia import (ALGOLIA_OBJECT_SIZE_LIMIT,
+                                                TransformDiscourseToAlgolia)
+from .data import LONG_POST, RAW_CATEGORIES, RAW_POSTS, transform_cooked
 
 
 class TestDiscourseAlgolia(unittest.TestCase):
@@ -228,6 +229,8 @@ class TestDiscourseAlgolia(unittest.TestCase):
             "tags": ["tag1", "tag2", "answered"],
             "type": "lvl3",
             "url": "http://example.com/t/web-requests-sending-images-mostly-fails/1437/3",
+            "topic_id": 1437,
+            "category_id": 13,
             "hierarchy": {"lvl0": "Forum", "lvl1": "Troubleshooting",
                           "lvl2": "Web requests: sending images mostly fails", "lvl3": "Header within the Post"},
             "weight": {
@@ -243,6 +246,8 @@ class TestDiscourseAlgolia(unittest.TestCase):
             "tags": ["tag1", "tag2", "answered"],
             "type": "content",
             "url": "http://example.com/t/web-requests-sending-images-mostly-fails/1437/3",
+            "topic_id": 1437,
+            "category_id": 13,
             "hierarchy": {"lvl0": "Forum", "lvl1": "Troubleshooting",
                           "lvl2": "Web requests: sending images mostly fails", "lvl3": None},
             "weight": {
@@ -256,5 +261,48 @@ class TestDiscourseAlgolia(unittest.TestCase):
         self.assertEqual(result, expected_result)
 
 
+class TestPackSections(unittest.TestCase):
+    maxDiff = None
+
+    def test_merges_paragraphs_under_the_same_header(self):
+        cooked = "<p>one</p><p>two</p><h2>Header</h2><p>three</p><p>four</p>"
+        result = transform_cooked(cooked, pack_bytes=100)
+        self.assertEqual(
+            [(obj['type'], obj['content'], obj['weight']['position']) for obj in result],
+            [("content", "one\ntwo", 0), ("lvl3", None, 2),
+             ("content", "three\nfour", 3)])
+
+    def test_respects_byte_budget(self):
+        cooked = "<p>aaaa</p><p>bbbb</p><p>cccc</p>"
+        result = transform_cooked(cooked, pack_bytes=9)
+        self.assertEqual([obj['content'] for obj in result],
+                         ["aaaa\nbbbb", "cccc"])
+        self.assertEqual([obj['weight']['position'] for obj in result], [0, 2])
+
+    def test_large_budget_never_splits_records(self):
+        paragraphs = [f"<p>{'word ' * 300}{i}</p>" for i in range(40)]
+        result = transform_cooked("".join(paragraphs), pack_bytes=9000)
+        positions = [obj['weight']['position'] for obj in result]
+        self.assertEqual(len(positions), len(set(positions)))
+        self.assertLess(len(result), 40)
+        for obj in result:
+            self.assertLessEqual(len(json.dumps(obj)), ALGOLIA_OBJECT_SIZE_LIMIT)
+
+    def test_packed_objectIDs_are_deterministic(self):
+        cooked = "<p>one</p><p>two</p><p>three</p>"
+        first = [obj['objectID'] for obj in transform_cooked(cooked, pack_bytes=100)]
+        second = [obj['objectID'] for obj in transform_cooked(cooked, pack_bytes=100)]
+        self.assertEqual(first, second)
+        self.assertEqual(len(set(first)), 1)
+
+    def test_unpacked_output_is_unchanged(self):
+        cooked = "<p>one</p><p>two</p>"
+        self.assertEqual(len(transform_cooked(cooked, pack_bytes=None)), 2)
+
+    def test_rejects_budget_over_record_limit(self):
+        with self.assertRaises(ValueError):
+            transform_cooked("<p>one</p>", pack_bytes=20000)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,195 @@
+import unittest
+import json
+import threading
+import urllib.request
+
+from src.watch_discourse import (MAX_ATTEMPTS, RETRY_SECONDS, TopicDebouncer,
+                                 WatchIndexer, create_webhook_server,
+                                 handle_webhook, index_ready_topics,
+                                 post_key_from_url)
+from src.quarantine import DEFAULT_MAX_HTML_BYTES
+from src.record_hash import CONTENT_HASH_ATTRIBUTE, content_hash
+from .data import CATEGORIES, RAW_POSTS
+
+
+class FakeResponse:
+    def wait(self):
+        return self
+
+
+class FakeIndex:
+    def __init__(self):
+        self.saved = []
+        self.deleted = []
+        # Set to make the next calls fail like an unreachable algolia.
+        self.error = None
+
+    def save_objects(self, objects):
+        if self.error:
+            raise self.error
+        self.saved.extend(objects)
+        return FakeResponse()
+
+    def delete_objects(self, object_ids):
+        if self.error:
+            raise self.error
+        self.deleted.extend(object_ids)
+        return FakeResponse()
+
+
+class TestTopicDebouncer(unittest.TestCase):
+
+    def test_coalesces_events_for_a_topic(self):
+        debouncer = TopicDebouncer(debounce=5, max_delay=30)
+        post = RAW_POSTS[0].copy()
+        debouncer.add_post(post, now=0)
+        edited = dict(post, cooked="<p>edited</p>")
+        debouncer.add_post(edited, now=2)
+        self.assertEqual(debouncer.pop_ready(now=6), [])
+        ready = debouncer.pop_ready(now=7)
+        self.assertEqual(len(ready), 1)
+        topic_id, pending = ready[0]
+        self.assertEqual(topic_id, post["topic_id"])
+        self.assertEqual(pending["posts"], {post["id"]: edited})
+        self.assertEqual(len(debouncer), 0)
+
+    def test_busy_topic_is_flushed_after_max_delay(self):
+        debouncer = TopicDebouncer(debounce=5, max_delay=10)
+        post = RAW_POSTS[0].copy()
+        for now in range(0, 12, 2):
+            debouncer.add_post(post, now=now)
+        self.assertEqual(len(debouncer.pop_ready(now=10)), 1)
+
+    def test_destroyed_topic_drops_pending_posts(self):
+        debouncer = TopicDebouncer(debounce=5, max_delay=30)
+        debouncer.add_post(RAW_POSTS[0].copy(), now=0)
+        debouncer.add_topic(RAW_POSTS[0]["topic_id"], destroyed=True, now=1)
+        _, pending = debouncer.pop_ready(now=10)[0]
+        self.assertTrue(pending["destroyed"])
+        self.assertEqual(pending["posts"], {})
+
+    def test_failed_topic_is_retried_with_backoff(self):
+        debouncer = TopicDebouncer(debounce=0, max_delay=30)
+        debouncer.add_post(RAW_POSTS[0].copy(), now=0)
+        topic_id, pending = debouncer.pop_ready(now=0)[0]
+        self.assertTrue(debouncer.requeue(topic_id, pending, now=0))
+        self.assertEqual(debouncer.pop_ready(now=RETRY_SECONDS - 1), [])
+        _, pending = debouncer.pop_ready(now=RETRY_SECONDS)[0]
+        self.assertTrue(debouncer.requeue(topic_id, pending, now=RETRY_SECONDS))
+        self.assertEqual(debouncer.pop_ready(now=2 * RETRY_SECONDS), [])
+        self.assertEqual(len(debouncer.pop_ready(now=3 * RETRY_SECONDS)), 1)
+
+    def test_topic_is_dropped_after_max_attempts(self):
+        debouncer = TopicDebouncer(debounce=0, max_delay=0)
+        debouncer.add_post(RAW_POSTS[0].copy(), now=0)
+        now = 0
+        for attempt in range(MAX_ATTEMPTS):
+            topic_id, pending = debouncer.pop_ready(now=now)[0]
+            requeued = debouncer.requeue(topic_id, pending, now=now)
+            now += RETRY_SECONDS * 2 ** attempt
+        self.assertFalse(requeued)
+        self.assertEqual(len(debouncer), 0)
+        self.assertEqual(debouncer.dropped, [RAW_POSTS[0]["topic_id"]])
+
+
+class TestHandleWebhook(unittest.TestCase):
+
+    def test_post_destroyed_marks_post_deleted(self):
+        debouncer = TopicDebouncer(debounce=0, max_delay=0)
+        queued = handle_webhook(
+            debouncer, "post_destroyed", {"post": RAW_POSTS[0].copy()})
+        self.assertTrue(queued)
+        _, pending = debouncer.pop_ready()[0]
+        self.assertTrue(pending["posts"][RAW_POSTS[0]["id"]]["deleted_at"])
+
+    def test_ping_is_ignored(self):
+        debouncer = TopicDebouncer(debounce=0, max_delay=0)
+        self.assertFalse(handle_webhook(debouncer, "ping", {"ping": "OK"}))
+        self.assertEqual(len(debouncer), 0)
+
+    def test_webhook_server_queues_posted_payload(self):
+        debouncer = TopicDebouncer(debounce=5, max_delay=30)
+        server = create_webhook_server("127.0.0.1", 0, debouncer)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            host, port = server.server_address[:2]
+            request = urllib.request.Request(
+                f"http://{host}:{port}/",
+                data=json.dumps({"post": RAW_POSTS[0]}).encode("utf-8"),
+                headers={"X-Discourse-Event-Type": "post",
+                         "X-Discourse-Event": "post_edited"})
+            with urllib.request.urlopen(request) as response:
+                self.assertEqual(response.status, 202)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(debouncer), 1)
+
+
+class TestWatchIndexer(unittest.TestCase):
+
+    def setUp(self):
+        self.index = FakeIndex()
+        self.indexer = WatchIndexer(
+            self.index, "http://example.com", CATEGORIES, "Forum", ["community"])
+        self.post = RAW_POSTS[0].copy()
+
+    def _index_post(self, post):
+        debouncer = TopicDebouncer(debounce=0, max_delay=0)
+        debouncer.add_post(post)
+        return index_ready_topics(debouncer, self.indexer)
+
+    def test_reports_whether_anything_was_indexed(self):
+        self.assertFalse(index_ready_topics(
+            TopicDebouncer(debounce=0, max_delay=0), self.indexer))
+        self.assertTrue(self._index_post(self.post))
+
+    def test_upserts_records_for_new_post(self):
+        self._index_post(self.post)
+        self.assertEqual(len(self.index.saved), 3)
+        self.assertEqual(self.index.deleted, [])
+        key = post_key_from_url(self.index.saved[0]["url"])
+        self.assertEqual(key, "1436/4")
+        self.assertEqual(len(self.indexer.records_by_post[key]), 3)
+
+    def test_upserts_carry_content_hash(self):
+        self._index_post(self.post)
+        for record in self.index.saved:
+            self.assertEqual(record[CONTENT_HASH_ATTRIBUTE], content_hash(record))
+
+    def test_deletes_stale_records_for_edited_post(self):
+        self._index_post(self.post)
+        old_ids = set(self.indexer.records_by_post["1436/4"])
+        self.index.saved = []
+        self._index_post(dict(self.post, cooked="<p>Only one paragraph</p>"))
+        self.assertEqual(len(self.index.saved), 1)
+        self.assertEqual(len(self.index.deleted), 2)
+        self.assertTrue(set(self.index.deleted) <= old_ids)
+
+    def test_oversized_post_is_quarantined(self):
+        cooked = "<p>start</p><pre>" + "x" * DEFAULT_MAX_HTML_BYTES + "</pre>"
+        self._index_post(dict(self.post, cooked=cooked))
+        self.assertEqual(len(self.index.saved), 1)
+
+    def test_failed_delete_is_retried(self):
+        self._index_post(self.post)
+        debouncer = TopicDebouncer(debounce=0, max_delay=0)
+        debouncer.add_post(dict(self.post, deleted_at="2023-06-09T00:00:00Z"), now=0)
+        self.index.error = RuntimeError("algolia is down")
+        self.assertFalse(index_ready_topics(debouncer, self.indexer, now=0))
+        self.assertIn("1436/4", self.indexer.records_by_post)
+        self.index.error = None
+        self.assertTrue(index_ready_topics(debouncer, self.indexer, now=RETRY_SECONDS))
+        self.assertEqual(len(self.index.deleted), 3)
+        self.assertNotIn("1436/4", self.indexer.records_by_post)
+
+    def test_deletes_all_records_for_deleted_post(self):
+        self._index_post(self.post)
+        self._index_post(dict(self.post, deleted_at="2023-06-09T00:00:00Z"))
+        self.assertEqual(len(self.index.deleted), 3)
+        self.assertNotIn("1436/4", self.indexer.records_by_post)
+
+
+if __name__ == "__main__":
+    unittest.main()